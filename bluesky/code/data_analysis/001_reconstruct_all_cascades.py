@@ -15,16 +15,18 @@ Output:
         - The output directory will contain subdirectories that indicate the creation parameters
             utilized (gamma and alpha).
         - Inside those subdirectories, a directory will be created based on the cascade ID
-        - Files inside the cascade ID directory (GMLz format) will represent different versions
-            of that cascade ID and will be zfilled and numbered 001, 002, ... 100.
+        - Files inside the cascade ID directory (parquet edge lists with `source` and
+            `target` columns) will represent different versions of that cascade ID and
+            will be zfilled and numbered 001, 002, ... 100.
+        - The cascade ID, alpha and gamma are stored in each file's key-value metadata.
     - E.g., the structure below shows 100 versions of cascade `cleaned-uri-string` (replaced by
         a "cleaned" URI value; see function below):
         ```
         `cleaned-uri-string/`
-        |- v_001.gmlz
-        |- v_002.gmlz
+        |- v_001.parquet
+        |- v_002.parquet
         |- ...
-        |- v_100.gmlz
+        |- v_100.parquet
         ```
     - We also save a new line delimited .txt file where each line represents one of the URIs that we generate
 Authors:
@@ -32,22 +34,21 @@ Authors:
 - Matthew DeVerna
 """
 
-import multiprocessing
 import os
 import warnings
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 import numpy as np
 import pandas as pd
-
-from igraph import Graph
-from joblib import Parallel, delayed
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 # Local project package
 from pkg import reconstruction
 
-
 N_SIMULATIONS = 100
-N_PROCS = multiprocessing.cpu_count()
 
 AUTHORS_DIR = "/data_volume/cascade_reconstruction/bluesky/author_profiles"
 DATA_DIR = "/data_volume/cascade_reconstruction/bluesky/sampled_cascades"
@@ -58,74 +59,72 @@ GAMMA_VALUES = [0.25, 0.5, 0.75]
 ALPHA_VALUES = [1.1, 1.5, 2.0, 2.5, 3.0]
 XMIN = 1
 
+# Threads used to write the versions of each cascade to disk
+N_WRITE_THREADS = 8
+
 
 def load_authors_data():
     """
     Return a dataframe of authors meta data
+
+    An author's profile may be in more than one file (e.g., a list collected both
+    in the old one-file-per-list format and in a later run), so only the first
+    profile of each author is kept.
     """
-    author_files = [os.path.join(AUTHORS_DIR, f) for f in os.listdir(AUTHORS_DIR)]
+    author_files = [
+        os.path.join(AUTHORS_DIR, f)
+        for f in os.listdir(AUTHORS_DIR)
+        if f.endswith(".parquet")
+    ]
     authors = []
     for f in author_files:
         authors.append(pd.read_parquet(f))
-    return pd.concat(authors).reset_index(drop=True)
+    return pd.concat(authors).drop_duplicates("did").reset_index(drop=True)
 
 
-def entire_cascade_reconstruction(
-    poten_edge_users, poten_edge_tstamps, poten_edge_fcounts, gamma, alpha, xmin
-):
+def clean_uris_for_fnames(uris):
     """
-    Function to reconstruct a single cascade using pkg library.
+    Remove the repetative text from a list of uris for simpler file names
 
-    Parameters:
-    ----------
-    - Same as reconstruction.get_who_rtd_whom() from local package.
-
-    Returns:
-    ----------
-    - edge_list (list) : list of tuples representing a directed graph's edges
-        - Format will be (source, target) or (parent_id, reposter_id)
+    Converts
+        - 'at://did:plc:223yxsx3ifr4vghg36hi3w4a/app.bsky.feed.post/3kmrdg2pfom2f'
+    to
+        - '223yxsx3ifr4vghg36hi3w4a-3kmrdg2pfom2f'
     """
-    # Must be true so we save the calculation below
-    edge_list = [(poten_edge_users[0], poten_edge_users[1])]
-
-    # Iterate over all reposts (but the root and first RT) to infer the parent
-    num_reposts = len(poten_edge_tstamps)
-    for idx in range(2, num_reposts):
-        # Get the timestamp and post ID for the reposter
-        reposter_tstamp = poten_edge_tstamps[idx]
-        reposter_id = poten_edge_users[idx]
-
-        # Extract lists related to the potential parents
-        potential_tstamps = np.array(poten_edge_tstamps[:idx])
-        potential_parents = poten_edge_users[:idx]  # These are post IDs
-        potential_parents_fcounts = poten_edge_fcounts[:idx]
-
-        # Infer parent
-        inferred_parent = reconstruction.get_who_rtd_whom(
-            poten_edge_users=potential_parents,
-            poten_edge_tstamps=potential_tstamps,
-            poten_edge_fcounts=potential_parents_fcounts,
-            curr_tstamp=reposter_tstamp,
-            gamma=gamma,
-            alpha=alpha,  # can be determined by the fitting
-            xmin=xmin,  # this should be 1, representing one second
-        )
-
-        # Should be (source, target)
-        edge_list.append((inferred_parent, reposter_id))
-    return edge_list
+    return (
+        pd.Index(uris)
+        .str.removeprefix("at://did:plc:")
+        .str.replace("/app.bsky.feed.post/", "-", regex=False)
+        .tolist()
+    )
 
 
-def clean_uri_for_fname(uri):
+def write_cascade_version(edge_list, output_path_fname, uri, alpha, gamma):
     """
-    Remove the repetative text from a uri for a simpler file name
+    Write a single cascade version as a zstd-compressed parquet edge list.
 
-    Converts
-        - 'at://did:plc:223yxsx3ifr4vghg36hi3w4a/app.bsky.feed.post/3kmrdg2pfom2f'
-    to
-        - '223yxsx3ifr4vghg36hi3w4a-3kmrdg2pfom2f'
+    Parameters:
+    ----------
+    - edge_list (numpy.ndarray) : (num_edges, 2) array of (source, target) authors
+    - output_path_fname (str) : full path of the .parquet file to write
+    - uri (str) : the cascade ID
+    - alpha (float) : power law alpha used to create the cascade
+    - gamma (float) : gamma used to create the cascade
+
+    Returns:
+    ----------
+    None
     """
-    return uri.replace("at://did:plc:", "").replace("/app.bsky.feed.post/", "-")
+    # Store the edges, plus cascade ID and creation parameters as metadata
+    table = pa.table({"source": edge_list[:, 0], "target": edge_list[:, 1]})
+    table = table.replace_schema_metadata(
+        {
+            "cascade_id": uri,
+            "alpha": str(alpha),
+            "gamma": str(gamma),
+        }
+    )
+    pq.write_table(table, output_path_fname, compression="zstd", compression_level=3)
 
 
 if __name__ == "__main__":
@@ -135,42 +134,47 @@ if __name__ == "__main__":
     data = pd.read_parquet(os.path.join(DATA_DIR, "sampled_cascades.parquet"))
     authors_df = load_authors_data()
 
-    # Converting clean_dt to datetime (and sorting by uri just for sake of aesthetics)
-    data["clean_dt"] = data.clean_dt.dt.to_pydatetime()
+    # Sorting by uri just for sake of aesthetics
     data.sort_values("uri", ascending=True, inplace=True)
 
+    # Reposts belong to the cascade of the post they reshare (subject_uri),
+    # while original posts key on their own uri.
+    data["cas_key"] = data["subject_uri"].where(data["type"] == "repost", data["uri"])
+
+    # Add follower count column. Authors we don't have data for are NaN.
+    fc_map = authors_df.set_index("did")["followers_count"].to_dict()
+    data["followers_count"] = data["author"].map(fc_map)
+
     # Drop cascades where we don't have author data for all authors.
-    merge_df = pd.merge(
-        data,
-        authors_df[["did", "followers_count"]],
-        left_on="author",
-        right_on="did",
-        how="inner",  # excludes rows where authors are missing
-    )
-    # Differences in these counts reflect cascades that, in the new frame, have missing author info
-    cascade_df_counts = data.subject_uri.value_counts()
-    merged_df_counts = merge_df.subject_uri.value_counts()
-    difference = cascade_df_counts - merged_df_counts
-
-    # Find those cascades and drop them (n = 271)
-    cas_w_missing_authors = difference[difference != 0].index
-    rows_w_missing_authors = data.subject_uri.isin(
-        cas_w_missing_authors
-    ) | data.uri.isin(cas_w_missing_authors)
+    cas_w_missing_authors = data.loc[data.followers_count.isna(), "cas_key"].unique()
+    rows_w_missing_authors = data.cas_key.isin(cas_w_missing_authors)
     data = data[~rows_w_missing_authors].reset_index(drop=True)
 
-    # Merge again to add follower count column
-    data = pd.merge(
-        data,
-        authors_df[["did", "followers_count"]],
-        left_on="author",
-        right_on="did",
-        how="inner",
-    )
+    # Authors' integer IDs (created when sampling) for the compiled reconstruction
+    # functions. The lookup's row number equals the author_idx.
+    author_ids = pd.read_parquet(os.path.join(DATA_DIR, "author_ids.parquet"))
+    id_to_author = author_ids.sort_values("author_idx")["did"].to_numpy()
 
     # All other posts have type == "repost"
     all_cascades = list(data[data.type == "post"]["uri"].unique())
     num_cascades = len(all_cascades)
+    all_cascades_clean = clean_uris_for_fnames(all_cascades)
+
+    # Store each cascade as temporally ordered arrays (author IDs, timestamps,
+    # follower counts) plus whether it begins with the original post.
+    authors_arr = data["author_idx"].to_numpy(dtype=np.int64)
+    tstamps_arr = data["clean_dt"].to_numpy().astype("datetime64[s]").astype(np.int64)
+    fcounts_arr = data["followers_count"].to_numpy(dtype=np.float64)
+    is_post_arr = (data["type"] == "post").to_numpy()
+    cascade_arrays = dict()
+    for cas_key, row_idxs in data.groupby("cas_key", sort=False).indices.items():
+        order = row_idxs[np.argsort(tstamps_arr[row_idxs], kind="stable")]
+        cascade_arrays[cas_key] = (
+            authors_arr[order],
+            tstamps_arr[order],
+            fcounts_arr[order],
+            is_post_arr[order[0]],
+        )
 
     # Stores all of the uris that we use and later saves them
     all_uris = set()
@@ -202,25 +206,25 @@ if __name__ == "__main__":
                     print(f"Cascade directories in {alpha_dir}: {num_cascade_dirs}")
                     print("Some cascades not generated so we continue...")
 
-            for cas_num, uri in enumerate(all_cascades, start=1):
+            for cas_num, (uri, uri_clean) in enumerate(
+                zip(all_cascades, all_cascades_clean), start=1
+            ):
                 print(f"Working on cascade: {uri} ({cas_num}/{num_cascades})...")
-                uri_clean = clean_uri_for_fname(uri)
                 cascade_dir = os.path.join(alpha_dir, uri_clean)
                 if os.path.exists(cascade_dir) and len(os.listdir(cascade_dir)) == 100:
                     print(f"\t - Directory <{cascade_dir}> already exists. Skipping...")
                     continue
 
                 # Select a single cascades data
-                cascade_frame = pd.concat(
-                    [data[data["uri"] == uri], data[data["subject_uri"] == uri]]
-                )
-
-                cascade_frame = cascade_frame.sort_values(
-                    "clean_dt", ascending=True
-                ).reset_index(drop=True)
+                (
+                    poten_edge_users,
+                    poten_edge_tstamps,
+                    poten_edge_fcounts,
+                    starts_with_post,
+                ) = cascade_arrays[uri]
 
                 # This happens for 19 cascades.
-                if cascade_frame.iloc[0]["type"] != "post":
+                if not starts_with_post:
                     print("\t - Skip cascade: original post comes after a repost.")
                     continue
 
@@ -228,58 +232,38 @@ if __name__ == "__main__":
                 all_uris.add(uri)
                 os.makedirs(cascade_dir, exist_ok=True)
 
-                num_posts = len(cascade_frame)
+                num_posts = len(poten_edge_users)
                 print(f"\t - Number of posts: {num_posts:,}")
 
                 # We only need to generate one version of cascades len 2 because we are not guessing.
                 num_cascade_versions = 1 if (num_posts == 2) else N_SIMULATIONS
 
-                # Create lists for the function below
-                poten_edge_users = list(cascade_frame["author"])
-                poten_edge_tstamps = [
-                    int(dt.timestamp()) for dt in cascade_frame.clean_dt
-                ]
-                poten_edge_fcounts = np.array(cascade_frame["followers_count"])
-
-                ## Using joblib (https://joblib.readthedocs.io/en/latest/) ----> much faster
-                backend = "loky"
-                edge_lists = Parallel(n_jobs=N_PROCS, backend=backend)(
-                    delayed(entire_cascade_reconstruction)(
-                        poten_edge_users,
-                        poten_edge_tstamps,
-                        poten_edge_fcounts,
-                        gamma,
-                        alpha,
-                        XMIN,
-                    )
-                    for _ in range(num_cascade_versions)
+                # Versions are reconstructed in parallel threads by numba
+                edge_arrays = reconstruction.run_versions(
+                    poten_edge_users,
+                    poten_edge_tstamps,
+                    poten_edge_fcounts,
+                    gamma,
+                    alpha,
+                    XMIN,
+                    num_cascade_versions,
                 )
 
-                # Save each version as it's own graph file
-                for vnum, edge_list in enumerate(edge_lists, start=1):
-                    # Create the graph, store cascade ID and creation parameters
-                    g = Graph(directed=True)
-                    g.cascade_id = uri
-                    g.alpha = alpha
-                    g.gamma = gamma
-
-                    # Generate vertex set
-                    all_vertices = set()
-                    for source, target in edge_list:
-                        all_vertices.add(source)
-                        all_vertices.add(target)
-
-                    # Add vertices and edges
-                    g.add_vertices(list(all_vertices))
-                    g.add_edges(edge_list)
-
-                    # Create the correct directory and filename
-                    output_path_fname = os.path.join(
-                        cascade_dir, f"v_{str(vnum).zfill(3)}.gmlz"
-                    )
+                # Map integer IDs back to authors
+                edge_lists = [id_to_author[edge_array] for edge_array in edge_arrays]
 
-                    # Write the compressed graphml file for each cascade version
-                    g.write(output_path_fname, format="graphmlz")
+                # Save each version as it's own graph file. Writes happen in
+                # threads so compression and disk IO of versions overlap.
+                output_fnames = [
+                    os.path.join(cascade_dir, f"v_{str(vnum).zfill(3)}.parquet")
+                    for vnum in range(1, len(edge_lists) + 1)
+                ]
+                with ThreadPoolExecutor(max_workers=N_WRITE_THREADS) as executor:
+                    write_version = partial(
+                        write_cascade_version, uri=uri, alpha=alpha, gamma=gamma
+                    )
+                    # Consume the results so any write errors are raised here
+                    list(executor.map(write_version, edge_lists, output_fnames))
 
     output_uri_filepath = os.path.join(DATA_DIR, "final_uris_list.txt")
     with open(output_uri_filepath, "w") as file:
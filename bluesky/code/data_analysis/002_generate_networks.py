@@ -22,8 +22,10 @@ Author: Matthew DeVerna
 
 import os
 
+import numpy as np
+import pyarrow.parquet as pq
+
 from collections import defaultdict
-from collections import Counter
 
 from igraph import Graph
 from joblib import Parallel, delayed
@@ -87,14 +89,14 @@ def generate_net_ver_paths_map(cascade_numv_map, data_dir, n_versions):
             if num_files == 100:
                 padded_ver = f"{str(ver)}".zfill(3)
                 net_ver_files_map[ver].append(
-                    os.path.join(data_dir, cascade_id, f"v_{padded_ver}.gmlz")
+                    os.path.join(data_dir, cascade_id, f"v_{padded_ver}.parquet")
                 )
 
             # Otherwise, there is only 1 version (cascade length = 2)
             # so we use that version specifically
             else:
                 net_ver_files_map[ver].append(
-                    os.path.join(data_dir, cascade_id, "v_001.gmlz")
+                    os.path.join(data_dir, cascade_id, "v_001.parquet")
                 )
     return dict(net_ver_files_map)
 
@@ -113,35 +115,35 @@ def generate_network(files_to_load, netv):
     ---------
     - global_net (igraph.Graph): Directed retweet network inclusive of all cascades
     """
-    # Load all verticies and edges.
-    # Use "names" (user IDs) to be consistent across cascades
-    all_vertices = set()
-    all_edges = list()
+    # Load all cascade edge lists.
+    # Use "names" (user IDs) to be consistent across cascades. Each name is mapped
+    # to a global vertex index so edges can be handled as integers.
+    name_to_idx = dict()
+    all_sources = list()
+    all_targets = list()
     for file in files_to_load:
-        g = Graph.Read_GraphMLz(file)
-        all_vertices.update(g.vs["name"])
-        all_edges.extend(
-            [(g.vs[edge.source]["name"], g.vs[edge.target]["name"]) for edge in g.es]
+        cascade_edges = pq.read_table(file, columns=["source", "target"])
+        all_sources.extend(
+            name_to_idx.setdefault(name, len(name_to_idx))
+            for name in cascade_edges["source"].to_pylist()
+        )
+        all_targets.extend(
+            name_to_idx.setdefault(name, len(name_to_idx))
+            for name in cascade_edges["target"].to_pylist()
         )
 
-    # Create the global network and add the vertices and edges
+    # Unique edges and their weights (number of occurrences) in one pass
+    edges = np.column_stack(
+        [np.array(all_sources, dtype=np.int64), np.array(all_targets, dtype=np.int64)]
+    )
+    unique_edges, weights = np.unique(edges, axis=0, return_counts=True)
+
+    # Create the global network and add the vertices and weighted edges
     global_net = Graph(directed=True)
     global_net["version"] = netv
-    global_net.add_vertices(list(all_vertices))
-    global_net.add_edges(list(set(all_edges)))
-
-    # Determine edge weights
-    edge_weight_counter = Counter()
-    for edge in all_edges:
-        edge_weight_counter[edge] += 1
-
-    # Update weights
-    global_net.es["weight"] = [
-        edge_weight_counter[
-            (global_net.vs[edge.source]["name"], global_net.vs[edge.target]["name"])
-        ]
-        for edge in global_net.es
-    ]
+    global_net.add_vertices(list(name_to_idx))
+    global_net.add_edges(unique_edges.tolist())
+    global_net.es["weight"] = weights.tolist()
 
     return global_net
 
@@ -15,7 +15,6 @@ import os
 import numpy as np
 import pandas as pd
 
-from collections import Counter
 from igraph import Graph
 
 
@@ -50,44 +49,36 @@ def generate_naive_network(df, uris_list):
     reshared_posts = df[df.subject_uri.isin(uris_list)]
     df = pd.concat([original_posts, reshared_posts])
 
-    all_vertices = set(df["author"])
-    all_edges = list()
+    # Map user IDs to vertex indices so edges can be handled as integers
+    all_vertices = list(set(df["author"]))
+    vertex_index = pd.Index(all_vertices)
 
-    # Iterate over unique cascade_ids
-    for cascade_id in uris_list:
-        # Filter the DataFrame for the current cascade_id (uri)
-        cas_original_posts = df[df.uri == cascade_id]
-        cas_reshared_posts = df[df.subject_uri == cascade_id]
-        cascade_df = pd.concat([cas_original_posts, cas_reshared_posts])
+    # Each row's cascade (root post uri): reposts belong to the post they reshare,
+    # while original posts key on their own uri
+    is_root = df["type"] == "post"
+    root_uris = df["subject_uri"].where(df["type"] == "repost", df["uri"])
 
-        # Extract the root and retweeters user_ids
-        is_root = cascade_df["type"] == "post"
-        root = cascade_df.loc[is_root, "author"].values[0]
-        retweeters = cascade_df.loc[~is_root, "author"].values
+    # The author of each (first) root post, looked up for every repost at once
+    # rather than filtering the dataframe once per cascade
+    root_authors = df.loc[is_root].drop_duplicates("uri").set_index("uri")["author"]
+    reposts = df.loc[~is_root]
 
-        # Use broadcasting to create pairs
-        new_edges = np.column_stack((np.full(retweeters.shape, root), retweeters))
+    # (root, reposter) pairs
+    all_edges = np.column_stack(
+        (
+            vertex_index.get_indexer(root_uris[~is_root].map(root_authors)),
+            vertex_index.get_indexer(reposts["author"]),
+        )
+    )
 
-        # Flatten the array of arrays into a list of tuples and extend the edges list
-        all_edges.extend(map(tuple, new_edges))
+    # Unique edges and their weights (number of occurrences) in one pass
+    unique_edges, weights = np.unique(all_edges, axis=0, return_counts=True)
 
-    # Create the global network and add the vertices and edges
+    # Create the global network and add the vertices and weighted edges
     global_net = Graph(directed=True)
-    global_net.add_vertices(list(all_vertices))
-    global_net.add_edges(list(set(all_edges)))
-
-    # Determine edge weights
-    edge_weight_counter = Counter()
-    for edge in all_edges:
-        edge_weight_counter[edge] += 1
-
-    # Update weights
-    global_net.es["weight"] = [
-        edge_weight_counter[
-            (global_net.vs[edge.source]["name"], global_net.vs[edge.target]["name"])
-        ]
-        for edge in global_net.es
-    ]
+    global_net.add_vertices(all_vertices)
+    global_net.add_edges(unique_edges.tolist())
+    global_net.es["weight"] = weights.tolist()
 
     return global_net
 
@@ -22,11 +22,13 @@ Authors:
 - Matthew DeVerna
 """
 
+import multiprocessing
 import os
 
 import numpy as np
 import pandas as pd
 
+from joblib import Parallel, delayed
 from midterm.utils import collect_files_recursively
 
 
@@ -38,6 +40,7 @@ MATCHING_STR = "network_v*.parquet"
 
 K_VALUES = np.array([1, 5, 10, 15, 20, 25])
 METRIC_COLUMNS = ["degree", "strength", "kcore", "eigenval"]
+N_PROCS = multiprocessing.cpu_count()
 
 
 def extract_params(file_path):
@@ -72,32 +75,101 @@ def extract_params(file_path):
     }
 
 
-def select_top_k(df, col_name, k):
+def select_top_k(df, col_name, k_values):
     """
-    Given a dataframe, select the top k nodes based on a specified column.
+    Given a dataframe, select the top k nodes based on a specified column for
+    each k value. All percentile thresholds are calculated in a single pass.
 
     Parameters
     ----------
     - df (pandas.DataFrame: the data to select from
     - col_name (str): the column on which to base percentile calculations
-    - k (np.array): the k value on which to select
+    - k_values (np.array): the k values on which to select
 
     Returns
     ----------
-    selected_rows (dict): dataframe where the columns are ['user_id', `col_name`]
-        and rows are the selected nodes based on the associated k_value
+    selected_rows (dict): maps each k value to a dataframe where the columns are
+        ['user_id', `col_name`] and rows are the selected nodes for that k value
     """
-    threshold = np.percentile(df[col_name], 100 - k)
-    return df[df[col_name] >= threshold][["user_id", col_name]].reset_index(drop=True)
+    values = df[col_name].to_numpy()
+    thresholds = np.percentile(values, 100 - k_values)
+    return {
+        k: df.loc[values >= threshold, ["user_id", col_name]].reset_index(drop=True)
+        for k, threshold in zip(k_values, thresholds)
+    }
+
+
+def user_ids_to_array(user_ids, uid_index):
+    """
+    Convert user IDs to a sorted array of unique integer IDs.
+
+    Parameters
+    ----------
+    - user_ids (pandas.Series): unique user IDs to convert
+    - uid_index (pandas.Index): index of all naive network user IDs, whose
+        positions are used as the integer IDs
+
+    Returns
+    ----------
+    int_ids (np.array): sorted np.int32 array. Users missing from `uid_index`
+        get unique negative IDs so they never match a naive network user.
+    """
+    int_ids = uid_index.get_indexer(user_ids).astype(np.int32)
+    missing = int_ids == -1
+    int_ids[missing] = -1 - np.arange(missing.sum(), dtype=np.int32)
+    return np.sort(int_ids)
+
+
+def calc_jaccard_similarity(arr1, arr2):
+    """
+    Calculate the jaccard similarity of two sorted arrays of unique integer IDs.
+    """
+    intersection = np.intersect1d(arr1, arr2, assume_unique=True).size
+    return intersection / (arr1.size + arr2.size - intersection)
 
 
-def calc_jaccard_similarity(set1, set2):
+def process_file(file_path, top_naive, uid_index):
     """
-    Calculate the jaccard similarity of two sets.
+    Calculate the jaccard similarities between the naive and one PDI network's
+    top-k users for all metrics and k values.
+
+    Parameters
+    ----------
+    - file_path (str): full path to a PDI network centralities file
+    - top_naive (dict): maps (metric, k) to the sorted integer IDs of the naive
+        network's top-k users
+    - uid_index (pandas.Index): index of all naive network user IDs
+
+    Returns
+    ----------
+    jaccard_records (list[dict]): one record per (metric, k) combination
     """
-    intersection = set1.intersection(set2)
-    union = set1.union(set2)
-    return len(intersection) / len(union)
+    print(f"\t- Working on: {os.path.basename(file_path)}")
+
+    # Load file and parameters
+    pdi_centralities = pd.read_parquet(file_path)
+    pdi_params = extract_params(file_path)
+
+    jaccard_records = []
+    for metric in METRIC_COLUMNS:
+        top_pdi = select_top_k(pdi_centralities, metric, K_VALUES)
+        for k in K_VALUES:
+            naive_arr = top_naive[(metric, k)]
+            pdi_arr = user_ids_to_array(top_pdi[k]["user_id"], uid_index)
+            jaccard_similarity = calc_jaccard_similarity(naive_arr, pdi_arr)
+
+            jaccard_records.append(
+                {
+                    "net_version": pdi_params["ver_num"],
+                    "gamma": pdi_params["gamma"],
+                    "alpha": pdi_params["alpha"],
+                    "metric": metric,
+                    "k": k,
+                    "jaccard_sim": jaccard_similarity,
+                    "bigger_set_size": max(naive_arr.size, pdi_arr.size),
+                }
+            )
+    return jaccard_records
 
 
 if __name__ == "__main__":
@@ -105,11 +177,14 @@ if __name__ == "__main__":
     print("Loading naive centralities and selecting top k users for each metric...")
     naive_centralities = pd.read_parquet(NAIVE_NET_FILE)
 
-    # {(metric col name, k) : topk_df_rows}
+    # Map user IDs to integers once so top-k sets can be compared as int arrays
+    uid_index = pd.Index(naive_centralities["user_id"])
+
+    # {(metric col name, k) : sorted array of topk integer user IDs}
     top_naive = {
-        (metric, k): select_top_k(naive_centralities, metric, k)
+        (metric, k): user_ids_to_array(topk_rows["user_id"], uid_index)
         for metric in METRIC_COLUMNS
-        for k in K_VALUES
+        for k, topk_rows in select_top_k(naive_centralities, metric, K_VALUES).items()
     }
 
     # Select all PDI files
@@ -118,31 +193,11 @@ if __name__ == "__main__":
     )
 
     print("Begin iterating through files and calculating comparisons...")
-    jaccard_records = []
-    for file_path in sorted(centrality_files):
-        print(f"\t- Working on: {os.path.basename(file_path)}")
-
-        # Load file and parameters
-        pdi_centralities = pd.read_parquet(file_path)
-        pdi_params = extract_params(file_path)
-
-        for metric in METRIC_COLUMNS:
-            for k in K_VALUES:
-                naive_set = set(top_naive[(metric, k)]["user_id"])
-                pdi_set = set(select_top_k(pdi_centralities, metric, k)["user_id"])
-                jaccard_similarity = calc_jaccard_similarity(naive_set, pdi_set)
-
-                jaccard_records.append(
-                    {
-                        "net_version": pdi_params["ver_num"],
-                        "gamma": pdi_params["gamma"],
-                        "alpha": pdi_params["alpha"],
-                        "metric": metric,
-                        "k": k,
-                        "jaccard_sim": jaccard_similarity,
-                        "bigger_set_size": max(len(naive_set), len(pdi_set)),
-                    }
-                )
+    file_records = Parallel(n_jobs=N_PROCS)(
+        delayed(process_file)(file_path, top_naive, uid_index)
+        for file_path in sorted(centrality_files)
+    )
+    jaccard_records = [record for records in file_records for record in records]
 
     jaccard_df = pd.DataFrame(jaccard_records)
     jaccard_df.to_parquet(
@@ -14,11 +14,14 @@ Author:
 """
 
 import gzip
-import json
+import multiprocessing
 import os
 
+import orjson
 import pandas as pd
 
+from joblib import Parallel, delayed
+
 
 # Ensure we are in the scripts directory for relative paths
 script_directory = os.path.dirname(os.path.abspath(__file__))
@@ -28,6 +31,8 @@ DATA_DIR = "/data_volume/cascade_reconstruction/bluesky/firehose_data"
 OUPUT_DIR = "/data_volume/cascade_reconstruction/bluesky/clean_firehose_data"
 os.makedirs(OUPUT_DIR, exist_ok=True)
 
+N_PROCS = multiprocessing.cpu_count()
+
 COLUMNS2KEEP = [
     "type",
     "uri",
@@ -72,41 +77,35 @@ def lang_to_string(lang):
         print(lang)
 
 
-def uri_to_bsky_url(uri):
+def uris_to_bsky_urls(uris):
     """
-    Convert a Bluesky URI string to a corresponding webpage URL.
+    Convert Bluesky URI strings to their corresponding webpage URLs.
 
     Parameters:
-    - uri (str): The URI string.
+    - uris (pandas.Series): The URI strings. All must be of the action type
+        'app.bsky.feed.post'.
 
     Returns:
-    - str: The corresponding webpage URL.
+    - pandas.Series: The corresponding webpage URLs.
     """
-    if "app.bsky.feed.post" not in uri:
-        raise Exception(
-            "URLs can only be generated for the action type 'app.bsky.feed.post'"
-        )
-
     # Base URL for the transformation
     base_url = "https://bsky.app/profile"
 
     # Extract the URI identifier and the post ID
     # Example: 'at://did:plc:2vw2ctgmh5vzfjnr72ezcktm/app.bsky.feed.like/3kod4jlztdb2p'
-    parts = uri.split("/")
-    did_identifier = parts[2]  # These are unique identifiers for users
-    post_id = parts[4]  # Extracts post ID, e.g., '3k57juz37hs2e'
+    parts = uris.str.split("/", expand=True)
+    did_identifiers = parts[2]  # These are unique identifiers for users
+    post_ids = parts[4]  # Extracts post ID, e.g., '3k57juz37hs2e'
 
-    # Construct the URL
-    url = f"{base_url}/{did_identifier}/post/{post_id}"
-
-    return url
+    # Construct the URLs
+    return base_url + "/" + did_identifiers + "/post/" + post_ids
 
 
 def clean_post(post_object):
     """
     Return a cleaned post object. Repost subjects (the post reposted), will
-    be unnested. Post URLs will be generated from the URI. URIs only point to
-    the original post. I.e., repost URLs will point to the reposted post.
+    be unnested. URLs are generated later for all posts at once (see
+    `uris_to_bsky_urls()`).
 
     Parameters:
     -----------
@@ -120,33 +119,46 @@ def clean_post(post_object):
     if "subject" in post_object:
         post_object["subject_uri"] = post_object["subject"].get("uri")
         post_object["subject_cid"] = post_object["subject"].get("cid")
-
-    if "subject" in post_object:
-        post_object["url"] = uri_to_bsky_url(post_object["subject_uri"])
         del post_object["subject"]
-        return post_object
-    else:
-        post_object["url"] = uri_to_bsky_url(post_object["uri"])
     return post_object
 
 
-files = [os.path.join(DATA_DIR, file) for file in sorted(os.listdir(DATA_DIR))]
+def clean_one(file_path):
+    """
+    Clean a single daily firehose file and save it as a .parquet file.
+    Files that have already been cleaned are skipped, so restarts are safe.
 
+    Parameters:
+    -----------
+    - file_path (str): Path to a daily file collected with the Firehose streamer.
 
-for file_path in files:
+    Returns:
+    -----------
+    - None
+    """
 
     # Skip completed files
     file_date = extract_file_date(file_path)
     output_path = os.path.join(OUPUT_DIR, f"{file_date}__clean_bsky.parquet")
     if os.path.exists(output_path):
         print(f"Skipping {file_date}")
-        continue
+        return
 
     print(f"Processing {file_date}")
-    records = []
+    # Store each column in its own list rather than one dict per record
+    columns = {col: [] for col in COLUMNS2KEEP}
     with gzip.open(file_path, "rb") as f:
         for idx, line in enumerate(f):
-            record = json.loads(line)
+            # Cheap byte checks first. Lines missing any of these substrings cannot
+            # pass the filters below, so we skip parsing them entirely.
+            if (
+                (b'"create"' not in line)
+                or (b"app.bsky" not in line)
+                or (b"post" not in line)
+            ):
+                continue
+
+            record = orjson.loads(line)
 
             # Filter out deletions, irrelevant creations
             # (likes, blocks, follows, lists, etcs.)
@@ -176,15 +188,21 @@ for file_path in files:
             if is_reply or is_quote:
                 continue
 
-            try:
-                records.append(clean_post(record))
-            except:
-                print(record)
-                print("-" * 50)
+            post = clean_post(record)
+            for col, values in columns.items():
+                values.append(post.get(col))
 
     # Convert to dataframe and clean
-    df = pd.DataFrame.from_records(records)
-    df = df[COLUMNS2KEEP]
+    df = pd.DataFrame(columns)
+
+    # URLs only point to the original post. I.e., repost URLs will point to the
+    # reposted post. URLs can only be generated for the type 'app.bsky.feed.post'.
+    src_uris = df["subject_uri"].fillna(df["uri"])
+    is_feed_post = src_uris.str.contains("app.bsky.feed.post", regex=False)
+    print(f"Dropping {(~is_feed_post).sum():,} records without a post URI")
+    df = df[is_feed_post].reset_index(drop=True)
+    df["url"] = uris_to_bsky_urls(src_uris[is_feed_post].reset_index(drop=True))
+
     df.type = df.type.map(
         {"app.bsky.feed.post": "post", "app.bsky.feed.repost": "repost"}
     )
@@ -199,3 +217,12 @@ for file_path in files:
     print(f"Completed {file_date}")
     print("#" * 50)
     print("#" * 50)
+
+
+if __name__ == "__main__":
+    files = [os.path.join(DATA_DIR, file) for file in sorted(os.listdir(DATA_DIR))]
+
+    # Each daily file is written to its own output, so days are cleaned in parallel
+    Parallel(n_jobs=N_PROCS)(delayed(clean_one)(file_path) for file_path in files)
+
+    print("--- Script complete ---")
@@ -7,6 +7,8 @@ Input:
 
 Output:
     - .parquet file with sampled cascade data
+        - Includes an `author_idx` column (uint32) with an integer ID for each author
+    - .parquet file (`author_ids.parquet`) mapping each author `did` to its `author_idx`
 
 Author:
     - Matthew DeVerna
@@ -15,6 +17,7 @@ Author:
 import os
 import random
 
+import numpy as np
 import pandas as pd
 
 from datetime import datetime, timedelta
@@ -67,7 +70,14 @@ def sample_posts(input_dir, output_dir, num_posts, random_state=42):
     # There are many weird formatted times that do not match the standard atproto protocol.
     # They all BEGIN with the same 19 characters, what changes after that is the level of detail
     # with respect to timezone, milliseconds, etc. — to solve I simply cut them off.
-    all_dfs["clean_dt"] = pd.to_datetime(all_dfs["createdAt"].str[:19])
+    # Casting to a fixed-width "U19" array truncates them without creating new Python
+    # strings, and an explicit format lets pandas parse them all with its fast C path.
+    # Anything unparseable becomes NaT and is removed by the date range filter below.
+    all_dfs["clean_dt"] = pd.to_datetime(
+        all_dfs["createdAt"].to_numpy(dtype="U19"),
+        format="%Y-%m-%dT%H:%M:%S",
+        errors="coerce",
+    )
 
     # Still some
     start = datetime.strptime("2024-03-01", "%Y-%m-%d")
@@ -115,7 +125,16 @@ def sample_posts(input_dir, output_dir, num_posts, random_state=42):
     sampled_cascades = pd.concat([sampled_posts, sampled_reposts]).reset_index(
         drop=True
     )
+
+    # Map authors to integer IDs once so downstream steps do not have to rebuild it
+    author_codes, author_dids = pd.factorize(sampled_cascades["author"], sort=True)
+    sampled_cascades["author_idx"] = author_codes.astype("uint32")
+    author_ids = pd.DataFrame(
+        {"did": author_dids, "author_idx": np.arange(len(author_dids), dtype="uint32")}
+    )
+
     sampled_cascades.to_parquet(os.path.join(OUPUT_DIR, "sampled_cascades.parquet"))
+    author_ids.to_parquet(os.path.join(OUPUT_DIR, "author_ids.parquet"), index=False)
 
 
 if __name__ == "__main__":
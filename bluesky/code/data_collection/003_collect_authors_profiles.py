@@ -7,22 +7,57 @@ Input:
 
 Output:
     - .parquet file with downloaded actor data
+        - One file (`authors_{n}.parquet`) is written per run of the script
+    - `done.idx`: new line delimited indices of the author lists already collected
+        - Lists saved by earlier versions of this script, one file per list
+          (`{idx}_authors.parquet`), are also treated as collected
 
 Author:
     - Matthew DeVerna
 """
 
+import asyncio
 import os
-import random
-import time
 
+import numpy as np
 import pandas as pd
-
-from atproto import Client
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from atproto import AsyncClient
+from atproto.exceptions import NetworkError, RequestException
+from tenacity import (
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_exponential,
+    wait_random,
+)
 
 BSKY_DATA_DIR = "/data_volume/cascade_reconstruction/bluesky"
 CASCADES_FILE = "sampled_cascades/sampled_cascades.parquet"
 OUTPUT_DIR = "author_profiles"
+DONE_FILE = "done.idx"
+
+# Read once at import so a missing variable fails before any data is loaded
+BSKY_PASSWORD = os.environ["BSKY_PASSWORD"]
+
+PROFILE_SCHEMA = pa.schema(
+    [
+        ("did", pa.string()),
+        ("handle", pa.string()),
+        ("description", pa.string()),
+        ("followers_count", pa.int64()),
+        ("follows_count", pa.int64()),
+        ("posts_count", pa.int64()),
+        ("indexed_at", pa.string()),
+    ]
+)
+
+# Maximum number of get_profiles requests in flight at once
+MAX_CONCURRENT_REQUESTS = 10
+# Maximum number of attempts for a request that keeps failing with a retryable error
+MAX_ATTEMPTS = 5
 
 
 def chunk_list(lst, n):
@@ -32,40 +67,55 @@ def chunk_list(lst, n):
     return [lst[i : i + n] for i in range(0, len(lst), n)]
 
 
-if __name__ == "__main__":
-
-    cascades_file = os.path.join(BSKY_DATA_DIR, CASCADES_FILE)
-    output_path = os.path.join(BSKY_DATA_DIR, OUTPUT_DIR)
-    os.makedirs(output_path, exist_ok=True)
-
-    cascades_data = pd.read_parquet(cascades_file)
-    authors = set(cascades_data["author"])
-
-    bsky_password = os.environ.get("BSKY_PASSWORD")
-    print(bsky_password)
-    client = Client()
-    client.login("matthewdeverna.com", bsky_password)
-
-    # 25 is the maximum size number of profiles that can be requested per API call
-    sorted_authors = sorted(authors)
-    list_of_author_lists = chunk_list(sorted_authors, 25)
-
-    num_author_lists = len(list_of_author_lists)
-
-    for idx, authors in enumerate(list_of_author_lists):
-        prop_done = (idx + 1) / num_author_lists
-        print(f"Working on list {idx+1}/{num_author_lists} ({prop_done:.2%})")
+def is_retryable(exception):
+    """
+    Return True for errors that are worth retrying: rate limits (HTTP 429), server
+    errors (HTTP 5xx), and network errors/timeouts.
+    """
+    if isinstance(exception, NetworkError):
+        return True
+    if isinstance(exception, RequestException) and exception.response is not None:
+        status_code = exception.response.status_code
+        return status_code == 429 or status_code >= 500
+    return False
+
+
+@retry(
+    wait=wait_exponential(multiplier=1, max=30) + wait_random(0, 1),
+    stop=stop_after_attempt(MAX_ATTEMPTS),
+    retry=retry_if_exception(is_retryable),
+    reraise=True,
+)
+async def get_profiles(client, authors):
+    """
+    Request the profiles of up to 25 authors, retrying transient errors with
+    exponential backoff. The client refreshes its own session tokens, so logging in
+    again is never needed here.
+    """
+    # Ref: https://docs.bsky.app/docs/api/app-bsky-actor-get-profiles
+    return await client.get_profiles(authors)
 
-        # Pre-sorting the list above ensures the authors in each list are the same
-        # each time we run the script.
-        full_output_path = os.path.join(output_path, f"{idx}_authors.parquet")
-        if os.path.exists(full_output_path):
-            print("Skipping already collected authors...")
-            continue
 
+async def collect_author_list(client, semaphore, idx, authors, writer, completed):
+    """
+    Collect the profiles of one list of authors and write them to the output file.
+
+    Parameters:
+    -----------
+    - client (atproto.AsyncClient): logged in Bluesky client
+    - semaphore (asyncio.Semaphore): limits the number of concurrent requests
+    - idx (int): index of the author list, used to mark the list as done
+    - authors (list[str]): up to 25 author DIDs
+    - writer (pyarrow.parquet.ParquetWriter): writer of this run's output file
+    - completed (list[int]): indices of the lists collected in this run. `idx` is
+        appended once its profiles are written.
+
+    Returns:
+    - None
+    """
+    async with semaphore:
         try:
-            # Ref: https://docs.bsky.app/docs/api/app-bsky-actor-get-profiles
-            result = client.get_profiles(authors)
+            result = await get_profiles(client, authors)
 
             records = []
             for profile in result.profiles:
@@ -83,15 +133,86 @@ if __name__ == "__main__":
                     }
                 )
 
-            author_df = pd.DataFrame.from_records(records)
-            author_df.to_parquet(full_output_path)
+            writer.write_table(pa.Table.from_pylist(records, schema=PROFILE_SCHEMA))
+            completed.append(idx)
+            print(f"Collected author list {idx}.")
 
         except Exception as e:
             print(f"Exception on author list {idx}.\n\nError: {e}")
 
-        finally:
-            wait_time = random.randint(1, 3)
-            print(f"Sleeping {round(wait_time,2)} seconds...")
-            time.sleep(wait_time)
+
+async def main():
+    """
+    Collect the profiles of all authors in the sampled cascades concurrently.
+    """
+    cascades_file = os.path.join(BSKY_DATA_DIR, CASCADES_FILE)
+    output_path = os.path.join(BSKY_DATA_DIR, OUTPUT_DIR)
+    os.makedirs(output_path, exist_ok=True)
+
+    # Sorted unique authors in a single pass
+    cascades_data = pd.read_parquet(cascades_file, columns=["author"])
+    sorted_authors = np.unique(cascades_data["author"].to_numpy()).tolist()
+
+    client = AsyncClient()
+    await client.login("matthewdeverna.com", BSKY_PASSWORD)
+
+    # 25 is the maximum size number of profiles that can be requested per API call
+    list_of_author_lists = chunk_list(sorted_authors, 25)
+
+    num_author_lists = len(list_of_author_lists)
+
+    # Pre-sorting the list above ensures the authors in each list are the same
+    # each time we run the script, so collected lists can be skipped by index.
+    done_path = os.path.join(output_path, DONE_FILE)
+    done_idxs = set()
+    if os.path.exists(done_path):
+        with open(done_path, "r") as f:
+            done_idxs = {int(line) for line in f if line.strip()}
+
+    # Earlier versions of this script saved one `{idx}_authors.parquet` file per list
+    for fname in os.listdir(output_path):
+        list_idx, _, suffix = fname.partition("_")
+        if suffix == "authors.parquet" and list_idx.isdigit():
+            done_idxs.add(int(list_idx))
+    print(f"Skipping {len(done_idxs)} already collected author lists...")
+    print(f"Collecting {num_author_lists - len(done_idxs)} author lists...")
+
+    # All profiles of this run are streamed into a single file. It only receives
+    # its final name, and its lists are only marked as done, once it is closed.
+    run_num = sum(f.startswith("authors_") for f in os.listdir(output_path))
+    run_output_path = os.path.join(output_path, f"authors_{run_num}.parquet")
+    tmp_output_path = f"{run_output_path}.tmp"
+    writer = pq.ParquetWriter(
+        tmp_output_path,
+        PROFILE_SCHEMA,
+        compression="zstd",
+        compression_level=3,
+        use_dictionary=True,
+    )
+
+    # The client reuses its connections across requests, and the semaphore keeps
+    # at most MAX_CONCURRENT_REQUESTS of them in flight.
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    completed = []
+    try:
+        await asyncio.gather(
+            *(
+                collect_author_list(client, semaphore, idx, authors, writer, completed)
+                for idx, authors in enumerate(list_of_author_lists)
+                if idx not in done_idxs
+            )
+        )
+    finally:
+        writer.close()
+        if completed:
+            os.replace(tmp_output_path, run_output_path)
+            with open(done_path, "a") as f:
+                f.writelines(f"{idx}\n" for idx in completed)
+        else:
+            os.remove(tmp_output_path)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
 
     print("--- Script complete ---")
@@ -17,15 +17,14 @@ Output:
 Author: Matthew DeVerna
 """
 import argparse
+import csv
 import glob
 import os
 import time
 import sys
 
-import numpy as np
-import pandas as pd
-
 MB_MULTIPLIER = 10**-6  # Multiply num bytes by this to get MB
+IO_BUFFER_SIZE = 1 << 20  # 1 MiB buffers for streaming reads and writes
 
 
 def parse_cl_args():
@@ -51,67 +50,132 @@ def parse_cl_args():
     return parser.parse_args()
 
 
-def read_data(file_name, basename, fname_ext):
-    print(f"Reading ***{basename}*** data...")
-    if fname_ext == "csv":
-        data = pd.read_csv(file_name)
-    elif fname_ext == "txt":
-        with open(file_name, "r") as f:
-            data = f.readlines()
-    else:
-        sys.exit(
-            "ERROR: Can only handle csv and txt files at the moment."
-            f" A {fname_ext} file was provided."
-        )
-    return data
-
-
-def split_list_into_chunks(input_list, max_allowed_size_mb):
-    # Convert max_allowed_size from megabytes to bytes
-    buffer = 5_000_000  # Ensures we don't get stuck in a loop
-    max_allowed_size = (max_allowed_size_mb / MB_MULTIPLIER) - buffer
-    # print(f"max_allowed_size: {max_allowed_size}")
-
-    # Initialize variables
-    chunks = []  # List to store the chunks
-    current_chunk = []  # Current chunk being constructed
-    current_size = 0  # Size of the current chunk
-
-    for item in input_list:
-        item_size = len(
-            item.encode("utf-8")
-        )  # Calculate the size of the string in bytes
-
-        # If adding the current item to the chunk doesn't exceed the maximum size, add it
-        if current_size + item_size <= max_allowed_size:
-            current_chunk.append(item)
-            current_size += item_size
-        else:
-            # If adding the current item would exceed the maximum size, start a new chunk
-            chunks.append(current_chunk)
-            current_chunk = [item]
-            current_size = item_size
-
-    # Add the last chunk if it's not empty
-    if current_chunk:
-        chunks.append(current_chunk)
-
-    return chunks
-
-
-def save_data(file_name, fname_ext, data):
-    print("Saving data...")
-    if fname_ext == "csv":
-        data.to_csv(file_name, index=False)
-    elif fname_ext == "txt":
-        with open(file_name, "w") as f:
-            f.writelines("\n".join(data))
-    else:
-        sys.exit(
-            "ERROR: Can only handle csv and txt files at the moment."
-            f" A {fname_ext} file was provided."
-        )
-    print("Success.")
+def chunk_file_path(chunked_dir, basename, fnum, fname_ext):
+    """Return the path of chunk number `fnum`."""
+    return os.path.join(chunked_dir, f"{basename}_{str(fnum).zfill(5)}.{fname_ext}")
+
+
+def split_txt_file(file_name, chunked_dir, basename, fname_ext, max_mb):
+    """
+    Split a .txt file into chunks of at most `max_mb` megabytes in a single pass.
+
+    Lines are copied as raw bytes, so no line is decoded or re-encoded, and a new
+    chunk file is started whenever the next line would exceed the size limit.
+    A single line larger than the limit is written to its own chunk.
+
+    Returns the number of chunk files written.
+    """
+    print(f"Streaming ***{basename}*** data into chunks...")
+    max_allowed_size = max_mb / MB_MULTIPLIER
+
+    fnum = 1
+    current_size = 0
+    out_file = open(
+        chunk_file_path(chunked_dir, basename, fnum, fname_ext),
+        "wb",
+        buffering=IO_BUFFER_SIZE,
+    )
+    try:
+        with open(file_name, "rb", buffering=IO_BUFFER_SIZE) as in_file:
+            for line in in_file:
+                line_size = len(line)
+                if current_size > 0 and current_size + line_size > max_allowed_size:
+                    out_file.close()
+                    fnum += 1
+                    current_size = 0
+                    out_file = open(
+                        chunk_file_path(chunked_dir, basename, fnum, fname_ext),
+                        "wb",
+                        buffering=IO_BUFFER_SIZE,
+                    )
+                out_file.write(line)
+                current_size += line_size
+    finally:
+        out_file.close()
+
+    return fnum
+
+
+def iter_csv_records(in_file):
+    """
+    Yield the raw bytes of each record in a .csv file opened in binary mode.
+
+    Quoted values may span multiple lines, so lines are fed to `csv.reader` to find
+    where each record ends, and the bytes of the lines it consumed are yielded
+    unchanged. Lines are decoded as latin-1, which maps every byte to one character,
+    so the quote and newline bytes of any ASCII-compatible encoding are found.
+    """
+    record_lines = []
+
+    def read_lines():
+        for line in in_file:
+            record_lines.append(line)
+            yield line.decode("latin-1")
+
+    for _ in csv.reader(read_lines()):
+        yield b"".join(record_lines)
+        record_lines.clear()
+
+
+def split_csv_file(file_name, chunked_dir, basename, fname_ext, max_mb):
+    """
+    Split a .csv file into chunks of at most `max_mb` megabytes in a single pass.
+
+    Records are copied as raw bytes, so values are written back exactly as they
+    were (quoted values may span multiple lines). Each chunk starts with the header
+    record, and a new chunk file is started whenever the next record would exceed
+    the size limit. A single record larger than the limit is written to its own
+    chunk.
+
+    Returns the number of chunk files written.
+    """
+    print(f"Streaming ***{basename}*** data into chunks...")
+    max_allowed_size = max_mb / MB_MULTIPLIER
+
+    fnum = 1
+    out_file = open(
+        chunk_file_path(chunked_dir, basename, fnum, fname_ext),
+        "wb",
+        buffering=IO_BUFFER_SIZE,
+    )
+    try:
+        with open(file_name, "rb", buffering=IO_BUFFER_SIZE) as in_file:
+            records = iter_csv_records(in_file)
+            header = next(records, b"")
+            out_file.write(header)
+            current_size = len(header)
+            for record in records:
+                record_size = len(record)
+                if (
+                    current_size > len(header)
+                    and current_size + record_size > max_allowed_size
+                ):
+                    out_file.close()
+                    fnum += 1
+                    out_file = open(
+                        chunk_file_path(chunked_dir, basename, fnum, fname_ext),
+                        "wb",
+                        buffering=IO_BUFFER_SIZE,
+                    )
+                    out_file.write(header)
+                    current_size = len(header)
+                out_file.write(record)
+                current_size += record_size
+    finally:
+        out_file.close()
+
+    return fnum
+
+
+def get_max_file_size_mb(chunked_dir, basename, fname_ext):
+    """Return the size (in MB) of the largest chunk file."""
+    file_sizes = []
+    for file in glob.glob(os.path.join(chunked_dir, f"{basename}*.{fname_ext}")):
+        print(f"Checking file: {os.path.basename(file)}")
+        file_size = os.stat(file).st_size * MB_MULTIPLIER
+        print(f"\tfile size: {file_size}mb")
+        file_sizes.append(file_size)
+    return max(file_sizes)
 
 
 if __name__ == "__main__":
@@ -127,47 +191,23 @@ if __name__ == "__main__":
     chunked_dir = os.path.join(file_dir, f"chunked_{basename_no_ext}")
     os.makedirs(chunked_dir, exist_ok=True)
 
-    data = read_data(file_name, basename, fname_ext)
-
-    # Resave the data as it is with the chunked name
-    chunks = 1
-    out_file_path = os.path.join(
-        chunked_dir, f"{basename}_{str(chunks).zfill(5)}.{fname_ext}"
-    )
-    save_data(file_name=out_file_path, fname_ext=fname_ext, data=data)
-
-    # Now we iteratively check the file size to see if it needs to be halved for GitHub
     print(f"Maximum file size allowed is {max_mb}mb")
-    file_size_bytes = os.stat(out_file_path).st_size
-    max_file_size_mb = file_size_bytes * MB_MULTIPLIER
-
-    while max_file_size_mb > max_mb:
-        print(f"Current max file size is {max_file_size_mb}mb.")
-        print("Splitting the data...")
-        chunks += 1
-
-        if fname_ext == "csv":
-            print(f"... into {chunks} chunks...")
-            split_data = np.array_split(data, chunks)
-        elif fname_ext == "txt":
-            split_data = split_list_into_chunks(data, max_mb)
-
-        # Iterate through the chunks and save them accordingly
-        for fnum, data_chunk in enumerate(split_data, start=1):
-            out_file_path = os.path.join(
-                chunked_dir, f"{basename}_{str(fnum).zfill(5)}.{fname_ext}"
-            )
-
-            save_data(file_name=out_file_path, fname_ext=fname_ext, data=data_chunk)
-
-        file_sizes = []
-        for file in glob.glob(os.path.join(chunked_dir, f"{basename}*.{fname_ext}")):
-            print(f"Checking file: {os.path.basename(file)}")
-            file_size = os.stat(file).st_size * MB_MULTIPLIER
-            print(f"\tfile size: {file_size}mb")
-            file_sizes.append(file_size)
-
-        max_file_size_mb = max(file_sizes)
+
+    if fname_ext == "txt":
+        num_chunks = split_txt_file(
+            file_name, chunked_dir, basename, fname_ext, max_mb=max_mb
+        )
+    elif fname_ext == "csv":
+        num_chunks = split_csv_file(
+            file_name, chunked_dir, basename, fname_ext, max_mb=max_mb
+        )
+    else:
+        sys.exit(
+            "ERROR: Can only handle csv and txt files at the moment."
+            f" A {fname_ext} file was provided."
+        )
+    print(f"Saved {num_chunks} chunks.")
+    max_file_size_mb = get_max_file_size_mb(chunked_dir, basename, fname_ext)
 
     print(f"Largest file size is now {max_file_size_mb}mb.")
     print("--- Script complete. ---")
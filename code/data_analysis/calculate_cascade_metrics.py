@@ -6,7 +6,8 @@ Note:
     - Each metric will be mapped to it's cascade ID and version number.
 
 Output:
-    - Pandas dataframe of cascade metrics. Columns:
+    - Parquet dataset of cascade metrics, hive-partitioned by gamma and alpha
+        (i.e., cascade_metrics_statistics/gamma=0.5/alpha=1.1/part-0.parquet). Columns:
         - cascade_id (str): the ID of the cascade
         - version_num (int): the version number of the output file
         - depth (float): the maximum shortest path from the root node to any
@@ -21,12 +22,17 @@ Author:
 """
 
 import argparse
+import multiprocessing
 import os
+import pickle as pkl
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
 
-from collections import Counter
-from igraph import Graph
+from array import array
+from multiprocessing import Pool
 from pathlib import Path
 
 # Paths
@@ -36,6 +42,19 @@ CAS_DIR_BASE = "/data_volume/cascade_reconstruction"
 ALPHA_DIRS = ["alpha_1_1", "alpha_1_5", "alpha_2_0", "alpha_2_5", "alpha_3_0"]
 GAMMA_DIRS = ["gamma_0_25", "gamma_0_5", "gamma_0_75"]
 
+# All (gamma, alpha) metrics are written to one dataset, partitioned by directory
+METRICS_DATASET_DIR = os.path.join(OUTPUT_DIR, "cascade_metrics_statistics")
+METRICS_PARTITIONING = ds.partitioning(
+    pa.schema([("gamma", pa.float64()), ("alpha", pa.float64())]), flavor="hive"
+)
+
+# Only these columns of the cleaned data are utilized
+DATA_COLUMNS = ["cascade_id", "parent_tid", "cascade_root_tid", "tweet_date", "tid"]
+
+N_PROCS = multiprocessing.cpu_count()
+# Each task is a whole cascade (all of its versions)
+CHUNKSIZE = 4
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -62,13 +81,21 @@ def parse_args():
     return args
 
 
-def calculate_max_breadth(graph, root_id):
+def calculate_traversal_metrics(graph, root_id):
     """
-    Calculate the maximum breadth of the cascade.
-
-    Notes: Conducts a BFS from the root node, recording the depth of each node.
-        At the end, count the number of nodes at each depth, the max count will
-        be the maximum breadth.
+    Calculate the depth, structural virality and maximum breadth of the cascade
+    from a single BFS.
+
+    Notes: Conducts a BFS from the root node (ignoring edge directions), which returns
+        the start index of each depth "layer" in the visit order. The number of nodes
+        at each depth is the difference between consecutive start indices, the max
+        count will be the maximum breadth, and the number of layers gives the depth.
+        When the undirected cascade is a tree, the edge above each node lies on the
+        shortest path of s * (V - s) node pairs, where s is the size of the subtree
+        below it. Summing these over all edges gives the total pairwise distance, so
+        structural virality (the average shortest path length) needs no all-pairs BFS.
+        Cascades that are not trees fall back to igraph's eccentricity and
+        average_path_length.
 
     Parameters:
     ----------
@@ -77,36 +104,97 @@ def calculate_max_breadth(graph, root_id):
 
     Returns:
     ----------
+    - depth (float): the maximum distance from the root
+    - structural_virality (float): the average shortest path length between all nodes
     - max_breadth (int): the maximum breadth
     """
-    depth_counter = Counter()
-    # advanced=True includes the depth as we go
-    for step_info in graph.bfsiter(root_id, advanced=True):
-        curr_vertex, depth, parent_vertex = step_info[0], step_info[1], step_info[2]
-        depth_counter[depth] += 1
-
-    # Returns a descending sorted list of (depth, count) tuples
-    return depth_counter.most_common()[0][1]
-
-
-def create_cascade_to_seconds_map(df):
+    # The full traversal is done in C. layers[i] is where depth i starts in the
+    # visit order (with a final entry equal to the number of visited nodes) and
+    # parents[v] is the node v was reached from.
+    vids, layers, parents = graph.bfs(root_id, mode="all")
+    max_breadth = int(np.diff(layers).max())
+
+    num_nodes = graph.vcount()
+    is_tree = graph.ecount() == num_nodes - 1 and len(vids) == num_nodes
+    if num_nodes < 2 or not is_tree:
+        depth = graph.eccentricity(root_id, mode="all")
+        structural_virality = graph.average_path_length(directed=False)
+        return depth, structural_virality, max_breadth
+
+    depth = float(len(layers) - 2)
+
+    # Accumulate subtree sizes from the deepest layer up to the root's children
+    vids = np.asarray(vids)
+    parents = np.asarray(parents)
+    subtree_sizes = np.ones(num_nodes, dtype=np.int64)
+    for start, end in zip(layers[-2:0:-1], layers[-1:1:-1]):
+        layer_vids = vids[start:end]
+        np.add.at(subtree_sizes, parents[layer_vids], subtree_sizes[layer_vids])
+
+    below_sizes = subtree_sizes[vids[1:]]
+    total_distance = np.sum(below_sizes * (num_nodes - below_sizes))
+    structural_virality = float(2 * total_distance / (num_nodes * (num_nodes - 1)))
+    return depth, structural_virality, max_breadth
+
+
+def create_cascade_summary_maps(df):
     """
-    Generate a mapping of cascade IDs to the total number of seconds between the
-    earliest and oldest posts in each cascade.
+    Generate mappings of cascade IDs to the total number of seconds between the
+    earliest and oldest posts in each cascade, and to the number of unique users
+    in each cascade. The DataFrame is grouped only once for both.
     Parameters
     ----------
     df (pandas.DataFrame): The DataFrame containing the data.
     Returns
     -------
     cascade_id_to_seconds (dict): A {cascade_id: total_seconds} dictionary
+    cascade_id_to_num_unique_users (dict): A {cascade_id: num_unique_users} dictionary
     """
-    cascade_id_to_seconds = {}
-    for cascade, temp_frame in df.groupby("cascade_id"):
-        earliest_post = temp_frame.tweet_date.min()
-        oldest_post = temp_frame.tweet_date.max()
-        total_seconds = (oldest_post - earliest_post).total_seconds()
-        cascade_id_to_seconds[cascade] = total_seconds
-    return cascade_id_to_seconds
+    cascade_summary = df.groupby("cascade_id", sort=False).agg(
+        earliest_post=("tweet_date", "min"),
+        oldest_post=("tweet_date", "max"),
+        num_unique_users=("tid", "nunique"),
+    )
+    total_seconds = (
+        cascade_summary["oldest_post"] - cascade_summary["earliest_post"]
+    ).dt.total_seconds()
+    cascade_id_to_seconds = total_seconds.to_dict()
+    cascade_id_to_num_unique_users = cascade_summary["num_unique_users"].to_dict()
+    return cascade_id_to_seconds, cascade_id_to_num_unique_users
+
+
+def compute_metrics(task):
+    """
+    Calculate the metrics of every version of a single cascade.
+
+    Parameters:
+    ----------
+    - task (tuple): (cascade_path, cascade_root_tid) where cascade_path is the path
+        to the cascade's pickled list of version graphs, and cascade_root_tid is the
+        "name" of its root
+
+    Returns:
+    ----------
+    - version_metrics (list): (depth, structural_virality, size, max_breadth) of
+        each version, in version order
+    """
+    cascade_path, cascade_root_tid = task
+    with open(cascade_path, "rb") as f:
+        graph_list = pkl.load(f)
+
+    version_metrics = []
+    for g in graph_list:
+        # Looked up through igraph's hashed "name" index
+        root_index = g.vs.find(name=cascade_root_tid).index
+
+        # Metrics are calculated on the undirected cascade by ignoring edge directions
+        # rather than rebuilding each graph as undirected.
+        depth, structural_virality, max_breadth = calculate_traversal_metrics(
+            g, root_id=root_index
+        )
+        size = g.vcount()
+        version_metrics.append((depth, structural_virality, size, max_breadth))
+    return version_metrics
 
 
 if __name__ == "__main__":
@@ -122,25 +210,23 @@ if __name__ == "__main__":
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     # Load data
     print("Creating a map from cascade ID to root tweet ID for all cascade IDs...")
-    df = pd.read_parquet(os.path.join(DATA_DIR, "clean_raw_data_anon.parquet"))
+    df = pd.read_parquet(
+        os.path.join(DATA_DIR, "clean_raw_data_anon.parquet"),
+        engine="pyarrow",
+        columns=DATA_COLUMNS,
+    )
     roots = df[df.parent_tid == "-1"]
-    cas_to_root_tid = {}
-    for cas_id, cas_root_tid in zip(roots.cascade_id, roots.cascade_root_tid):
-        cas_to_root_tid[cas_id] = cas_root_tid
-    print(f"\t- Done.")
-
-    print("Creating a map from cascade ID to total seconds...")
-    cascde_id_to_seconds = create_cascade_to_seconds_map(df)
+    cas_to_root_tid = roots.set_index("cascade_id")["cascade_root_tid"].to_dict()
     print(f"\t- Done.")
 
-    print("Creating a map from cascade ID to number of unique users...")
-    cascde_id_to_num_unique_users = df.groupby("cascade_id")["tid"].nunique().to_dict()
+    print("Creating maps from cascade ID to total seconds and unique users...")
+    cascde_id_to_seconds, cascde_id_to_num_unique_users = create_cascade_summary_maps(
+        df
+    )
     print(f"\t- Done.")
 
     del df
 
-    not_undirected_err_msg = f"Error, Graph was not changed to undirected!"
-
     for gamma_dir in gamma_dirs:
         gamma_value = ".".join(gamma_dir.split("_")[1:])
 
@@ -164,61 +250,94 @@ if __name__ == "__main__":
             # Handles symbolic link weirdness, if present.
             full_alpha_dir = Path(full_alpha_dir).resolve()
 
-            all_cascade_ids = [
-                d
-                for d in os.listdir(full_alpha_dir)
-                if os.path.isdir(os.path.join(full_alpha_dir, d))
+            # Each cascade's versions are stored in one {cascade_id}.pkl file
+            with os.scandir(full_alpha_dir) as entries:
+                all_cascade_ids = [
+                    entry.name.removesuffix(".pkl")
+                    for entry in entries
+                    if entry.name.endswith(".pkl")
+                ]
+
+            # Accumulate each metric in its own typed column rather than a dict
+            # per row, since these can have > 4 million rows.
+            metric_columns = {
+                "cascade_id": [],
+                "version": array("q"),
+                "gamma": array("d"),
+                "alpha": array("d"),
+                "depth": array("d"),
+                "structural_virality": array("d"),
+                "size": array("q"),
+                "max_breadth": array("q"),
+                "total_seconds": array("d"),
+                "num_unique_users": array("q"),
+            }
+
+            # One task per cascade, processed in parallel
+            tasks = [
+                (
+                    os.path.join(full_alpha_dir, f"{cascade_id}.pkl"),
+                    cas_to_root_tid[cascade_id],
+                )
+                for cascade_id in all_cascade_ids
             ]
 
-            metric_records = []
-
-            for cascade_id in all_cascade_ids:
-                print(f"Generating statistics for cascade ID: {cascade_id}...")
-                num_versions = len(os.listdir(os.path.join(full_alpha_dir, cascade_id)))
-                for version_num in range(1, num_versions + 1):
-                    cascade_path = os.path.join(
-                        full_alpha_dir,
-                        cascade_id,
-                        f"v_{str(version_num).zfill(3)}.gmlz",
+            print(f"Generating statistics for {len(all_cascade_ids):,} cascades...")
+            with Pool(N_PROCS) as pool:
+                all_metrics = pool.imap(compute_metrics, tasks, chunksize=CHUNKSIZE)
+                for cascade_id, version_metrics in zip(all_cascade_ids, all_metrics):
+                    # Values that only depend on the cascade are looked up once and
+                    # repeated per version.
+                    num_versions = len(version_metrics)
+                    total_seconds = cascde_id_to_seconds[cascade_id]
+                    num_unique_users = cascde_id_to_num_unique_users[cascade_id]
+                    metric_columns["cascade_id"].extend([cascade_id] * num_versions)
+                    metric_columns["version"].extend(range(1, num_versions + 1))
+                    metric_columns["total_seconds"].extend(
+                        [total_seconds] * num_versions
                     )
-                    g = Graph.Read_GraphMLz(cascade_path)
-                    g.to_undirected()  # Changes graph in place
-                    assert not g.is_directed(), not_undirected_err_msg
-
-                    cascade_root_tid = cas_to_root_tid[cascade_id]
-                    root_index = g.vs.find(name=cascade_root_tid).index
-
-                    depth = g.eccentricity(root_index)
-                    structural_virality = g.average_path_length()
-                    size = g.vcount()
-                    max_breadth = calculate_max_breadth(g, root_id=root_index)
-
-                    metric_records.append(
-                        {
-                            "cascade_id": cascade_id,
-                            "version": version_num,
-                            "gamma": float(gamma_value),
-                            "alpha": float(alpha_value),
-                            "depth": depth,
-                            "structural_virality": structural_virality,
-                            "size": size,
-                            "max_breadth": max_breadth,
-                            "total_seconds": cascde_id_to_seconds[cascade_id],
-                            "num_unique_users": cascde_id_to_num_unique_users[
-                                cascade_id
-                            ],
-                        }
+                    metric_columns["num_unique_users"].extend(
+                        [num_unique_users] * num_versions
                     )
+                    depths, structural_viralities, sizes, max_breadths = zip(
+                        *version_metrics
+                    )
+                    metric_columns["depth"].extend(depths)
+                    metric_columns["structural_virality"].extend(structural_viralities)
+                    metric_columns["size"].extend(sizes)
+                    metric_columns["max_breadth"].extend(max_breadths)
+
+            num_rows = len(metric_columns["cascade_id"])
+            metric_columns["gamma"] = array("d", [float(gamma_value)]) * num_rows
+            metric_columns["alpha"] = array("d", [float(alpha_value)]) * num_rows
 
             print(f"Saving cascade metric statistics for...")
             print(f"\t- gamma = {gamma_value}, alpha = {alpha_value}...")
-            metric_stats_df = pd.DataFrame.from_records(metric_records)
-            stats_outpath = os.path.join(
-                OUTPUT_DIR,
-                f"cascade_metrics_statistics_{gamma_dir}_{alpha_dir}.parquet",
+            # np.asarray wraps the typed arrays' buffers without copying them
+            metric_stats_table = pa.table(
+                {
+                    col: values if isinstance(values, list) else np.asarray(values)
+                    for col, values in metric_columns.items()
+                }
+            )
+            del metric_columns
+            # Only this (gamma, alpha) partition is replaced, others are left as is
+            ds.write_dataset(
+                metric_stats_table,
+                METRICS_DATASET_DIR,
+                format="parquet",
+                partitioning=METRICS_PARTITIONING,
+                basename_template="part-{i}.parquet",
+                existing_data_behavior="delete_matching",
+                file_options=ds.ParquetFileFormat().make_write_options(
+                    compression="zstd",
+                    compression_level=3,
+                    use_dictionary=["cascade_id"],
+                ),
+                min_rows_per_group=500_000,
+                max_rows_per_group=500_000,
             )
-            metric_stats_df.to_parquet(stats_outpath)
-            del metric_stats_df  # This will b > 4 million rows so del for memory.
+            del metric_stats_table  # This will b > 4 million rows so del for memory.
 
     print("#" * 50)
     print("Script complete.")
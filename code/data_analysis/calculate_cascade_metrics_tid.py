@@ -38,13 +38,15 @@ Authors:
 """
 
 import argparse
+import gc
 import glob
 import os
 
+import numpy as np
 import pandas as pd
 import pickle as pkl
+import pyarrow.dataset as ds
 
-from collections import Counter
 
 DATA_DIR = "../../cleaned_data"
 TID_CASCADES_DIR = "../../output/reconstructed_data/time_inferred_diffusion"
@@ -53,6 +55,9 @@ TID_ALL_CASCADES_DIR = (
 )
 METRICS_DIR = "../../output/cascade_metrics"
 
+# Only these columns of the cleaned data are utilized
+DATA_COLUMNS = ["cascade_id", "parent_tid", "cascade_root_tid"]
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -68,13 +73,21 @@ def parse_args():
     return args
 
 
-def calculate_max_breadth(graph, root_id):
+def calculate_traversal_metrics(graph, root_id):
     """
-    Calculate the maximum breadth of the cascade.
-
-    Notes: Conducts a BFS from the root node, recording the depth of each node.
-        At the end, count the number of nodes at each depth, the max count will
-        be the maximum breadth.
+    Calculate the depth, structural virality and maximum breadth of the cascade
+    from a single BFS.
+
+    Notes: Conducts a BFS from the root node (ignoring edge directions), which returns
+        the start index of each depth "layer" in the visit order. The number of nodes
+        at each depth is the difference between consecutive start indices, the max
+        count will be the maximum breadth, and the number of layers gives the depth.
+        When the undirected cascade is a tree, the edge above each node lies on the
+        shortest path of s * (V - s) node pairs, where s is the size of the subtree
+        below it. Summing these over all edges gives the total pairwise distance, so
+        structural virality (the average shortest path length) needs no all-pairs BFS.
+        Cascades that are not trees fall back to igraph's eccentricity and
+        average_path_length.
 
     Parameters:
     ----------
@@ -83,16 +96,37 @@ def calculate_max_breadth(graph, root_id):
 
     Returns:
     ----------
+    - depth (float): the maximum distance from the root
+    - structural_virality (float): the average shortest path length between all nodes
     - max_breadth (int): the maximum breadth
     """
-    depth_counter = Counter()
-    # advanced=True includes the depth as we go
-    for step_info in graph.bfsiter(root_id, advanced=True):
-        curr_vertex, depth, parent_vertex = step_info[0], step_info[1], step_info[2]
-        depth_counter[depth] += 1
-
-    # Returns a descending sorted list of (depth, count) tuples
-    return depth_counter.most_common()[0][1]
+    # The full traversal is done in C. layers[i] is where depth i starts in the
+    # visit order (with a final entry equal to the number of visited nodes) and
+    # parents[v] is the node v was reached from.
+    vids, layers, parents = graph.bfs(root_id, mode="all")
+    max_breadth = int(np.diff(layers).max())
+
+    num_nodes = graph.vcount()
+    is_tree = graph.ecount() == num_nodes - 1 and len(vids) == num_nodes
+    if num_nodes < 2 or not is_tree:
+        depth = graph.eccentricity(root_id, mode="all")
+        structural_virality = graph.average_path_length(directed=False)
+        return depth, structural_virality, max_breadth
+
+    depth = float(len(layers) - 2)
+
+    # Accumulate subtree sizes from the deepest layer up to the root's children
+    vids = np.asarray(vids)
+    parents = np.asarray(parents)
+    subtree_sizes = np.ones(num_nodes, dtype=np.int64)
+    for start, end in zip(layers[-2:0:-1], layers[-1:1:-1]):
+        layer_vids = vids[start:end]
+        np.add.at(subtree_sizes, parents[layer_vids], subtree_sizes[layer_vids])
+
+    below_sizes = subtree_sizes[vids[1:]]
+    total_distance = np.sum(below_sizes * (num_nodes - below_sizes))
+    structural_virality = float(2 * total_distance / (num_nodes * (num_nodes - 1)))
+    return depth, structural_virality, max_breadth
 
 
 if __name__ == "__main__":
@@ -103,62 +137,66 @@ if __name__ == "__main__":
     print("Loading data...")
     if calculate_all:
         print("All cascades selected.")
-        dfs = []
-        for file in glob.glob(os.path.join(DATA_DIR, "v_0*.parquet")):
-            dfs.append(pd.read_parquet(file))
-        df = pd.concat(dfs)
+        # Scan all files as one dataset instead of reading and concatenating each
+        data_files = sorted(glob.glob(os.path.join(DATA_DIR, "v_0*.parquet")))
+        df = ds.dataset(data_files, format="parquet").to_table(columns=DATA_COLUMNS)
+        df = df.to_pandas()
     else:
         print("Subset of clean cascades selected.")
-        df = pd.read_parquet(os.path.join(DATA_DIR, "clean_raw_data_anon.parquet"))
+        df = pd.read_parquet(
+            os.path.join(DATA_DIR, "clean_raw_data_anon.parquet"),
+            engine="pyarrow",
+            columns=DATA_COLUMNS,
+        )
     print(f"\t- Success.")
 
     print("Creating a map from cascade ID to root tweet ID for all cascade IDs...")
     roots = df[df.parent_tid == "-1"]
-    cas_to_root_tid = {}
-    for cas_id, cas_root_tid in zip(roots.cascade_id, roots.cascade_root_tid):
-        cas_to_root_tid[cas_id] = cas_root_tid
+    cas_to_root_tid = roots.set_index("cascade_id")["cascade_root_tid"].to_dict()
     print(f"\t- Done.")
 
-    print("Loading graph files...")
     graph_files = sorted(
         glob.glob(os.path.join(cascades_dir, "time_inferred_diffusion_cascades_*.pkl"))
     )
-    graph_list = []
+
+    # Graphs are loaded one file at a time and dropped once their metrics are
+    # calculated, so only a single file of graphs is ever held in memory.
+    print(f"Calculating metrics for graphs in {len(graph_files)} files...")
+    metric_records = []
     for file in graph_files:
         print(f"\t- Loading {os.path.basename(file)}...")
         with open(file, "rb") as pkl_file:
-            graph_list.extend(pkl.load(pkl_file))
-    print(f"\t- Done.")
-
-    print(f"Calculating metrics for {len(graph_list)} graphs...")
-    metric_records = []
-    num_casades = len(graph_list)
-    for cas_num, g in enumerate(graph_list):
-        g.to_undirected()  # Changes graph in place
-        assert not g.is_directed()
-
-        cascade_id = g.cascade_id
-        if cascade_id == "0":
-            continue
-        print(f"\t- Working on cascade {cascade_id} ({cas_num}/{num_casades})...")
-
-        cascade_root_tid = cas_to_root_tid[cascade_id]
-        root_index = g.vs.find(name=cascade_root_tid).index
-
-        depth = g.eccentricity(root_index)
-        structural_virality = g.average_path_length()
-        size = g.vcount()
-        max_breadth = calculate_max_breadth(g, root_id=root_index)
-
-        metric_records.append(
-            {
-                "cascade_id": cascade_id,
-                "depth": depth,
-                "structural_virality": structural_virality,
-                "size": size,
-                "max_breadth": max_breadth,
-            }
-        )
+            graph_list = pkl.load(pkl_file)
+
+        num_casades = len(graph_list)
+        for cas_num, g in enumerate(graph_list):
+            cascade_id = g.cascade_id
+            if cascade_id == "0":
+                continue
+            print(f"\t- Working on cascade {cascade_id} ({cas_num}/{num_casades})...")
+
+            cascade_root_tid = cas_to_root_tid[cascade_id]
+            root_index = g.vs.find(name=cascade_root_tid).index
+
+            # Metrics are calculated on the undirected cascade by ignoring edge
+            # directions rather than rebuilding each graph as undirected.
+            depth, structural_virality, max_breadth = calculate_traversal_metrics(
+                g, root_id=root_index
+            )
+            size = g.vcount()
+
+            metric_records.append(
+                {
+                    "cascade_id": cascade_id,
+                    "depth": depth,
+                    "structural_virality": structural_virality,
+                    "size": size,
+                    "max_breadth": max_breadth,
+                }
+            )
+
+        del graph_list
+        gc.collect()
     print(f"\t- Done.\n")
 
     metric_records_df = pd.DataFrame.from_records(metric_records)
@@ -167,5 +205,12 @@ if __name__ == "__main__":
     fname = fname_all if calculate_all else fname
     output_full_path = os.path.join(METRICS_DIR, fname)
     print(f"\t- Saving {output_full_path}")
-    metric_records_df.to_parquet(output_full_path)
+    metric_records_df.to_parquet(
+        output_full_path,
+        engine="pyarrow",
+        compression="zstd",
+        compression_level=3,
+        use_dictionary=["cascade_id"],
+        row_group_size=500_000,
+    )
     print("Script complete.")
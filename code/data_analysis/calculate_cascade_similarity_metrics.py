@@ -30,14 +30,20 @@ Author:
 """
 import argparse
 import glob
+import multiprocessing
 import os
+import sys
 
 import numpy as np
 import pandas as pd
 import pickle as pkl
+import pyarrow as pa
+import pyarrow.parquet as pq
+import scipy.sparse as sparse
 
-from igraph import Graph
-from itertools import combinations
+from array import array
+from collections import defaultdict
+from multiprocessing import Pool
 from pathlib import Path
 
 from pkg.boot import bootstrap_ci
@@ -49,6 +55,38 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 ALPHA_DIRS = ["alpha_1_1", "alpha_1_5", "alpha_2_0", "alpha_2_5", "alpha_3_0"]
 GAMMA_DIRS = ["gamma_0_25", "gamma_0_5", "gamma_0_75"]
 
+# Number of cascades (with the same number of comparisons) bootstrapped together
+BOOTSTRAP_BATCH_SIZE = 256
+
+N_PROCS = multiprocessing.cpu_count()
+CHUNKSIZE = 64
+
+# Per-cascade summary statistics, in the row order used by add_summary_statistics()
+SUMMARY_STAT_COLUMNS = [
+    "jaccard_mean",
+    "prop_mismatched_parents_mean",
+    "jaccard_ci_low",
+    "jaccard_ci_hi",
+    "prop_mismatched_parents_ci_low",
+    "prop_mismatched_parents_ci_high",
+]
+
+# Results are written straight to parquet with this schema (see columns above)
+OUTPUT_SCHEMA = pa.schema(
+    [
+        ("gamma", pa.float64()),
+        ("alpha", pa.float64()),
+        ("cascade_id", pa.string()),
+        ("size", pa.int64()),
+        ("jaccard_mean", pa.float64()),
+        ("prop_mismatched_parents_mean", pa.float64()),
+        ("jaccard_ci_low", pa.float64()),
+        ("jaccard_ci_hi", pa.float64()),
+        ("prop_mismatched_parents_ci_low", pa.float64()),
+        ("prop_mismatched_parents_ci_high", pa.float64()),
+    ]
+)
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -81,34 +119,243 @@ def parse_args():
     return args
 
 
-def get_jaccard_mismatched(g1_edge_set, g2_edge_set):
+def get_edge_list(graph):
+    """
+    Get the node names and edges of a graph as arrays.
+
+    Parameters:
+    - graph (igraph.Graph): the cascade graph
+
+    Returns:
+    - names (numpy.ndarray): the 'name' (tid) of each node, ordered by vertex index
+    - edges (numpy.ndarray): a (num_edges x 2) array of (source, target) vertex indices
+    """
+    names = np.array(graph.vs["name"])
+    edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    return names, edges
+
+
+def read_cascade_edges(cascade_path):
     """
-    Calculate Jaccard similarity and proportion of mismatched parents between two sets of edges.
+    Read the edges of every version of a cascade.
+
+    Notes: The vertex indices of each version may not match across cascade versions,
+        so the node 'names' (tids) of all versions are factorized into node IDs
+        shared by all versions.
 
     Parameters:
-    - g1_edge_set (set): A set of edges representing the first graph.
-    - g2_edge_set (set): A set of edges representing the second graph.
+    - cascade_path (str): path to the cascade's pickled list of version graphs
 
     Returns:
-    - jaccard_similarity (float): The Jaccard similarity between the two edge sets.
-    - prop_mismatched_parents (float): The proportion of mismatched parents between the two edge sets.
+    - names (numpy.ndarray): the 'name' (tid) of each node, indexed by node ID
+    - edge_lists (list of numpy.ndarray): a (num_edges x 2) array of (source, target)
+        node IDs for each version
+    """
+    with open(cascade_path, "rb") as f:
+        graph_list = pkl.load(f)
+    version_edge_lists = [get_edge_list(graph) for graph in graph_list]
+    del graph_list
+
+    node_ids, names = pd.factorize(
+        np.concatenate([graph_names for graph_names, _ in version_edge_lists])
+    )
+    edge_lists = []
+    start = 0
+    for graph_names, graph_edges in version_edge_lists:
+        edge_lists.append(node_ids[start : start + len(graph_names)][graph_edges])
+        start += len(graph_names)
+    return np.asarray(names, dtype=str), edge_lists
+
+
+def map_edge_list(names, edge_list):
+    """
+    Map the edges of a graph onto the node IDs of a cascade.
+
+    Parameters:
+    - names (numpy.ndarray): the 'name' (tid) of each node of the cascade, indexed by
+        node ID, see read_cascade_edges()
+    - edge_list (tuple): (names, edges) of the graph, see get_edge_list()
+
+    Returns:
+    - edges (numpy.ndarray): a (num_edges x 2) array of (source, target) node IDs.
+        Nodes that are not in the cascade get new IDs.
+    """
+    graph_names, graph_edges = edge_list
+    node_ids = pd.Index(names).get_indexer(graph_names)
+    missing = node_ids < 0
+    node_ids[missing] = len(names) + np.arange(missing.sum())
+    return node_ids[graph_edges]
+
+
+def encode_edges(edge_lists):
     """
+    Encode the edges of several graphs as integers that are comparable across graphs.
+
+    Notes: Each edge is packed into a single uint64, (source_id << 32) | target_id.
+
+    Parameters:
+    - edge_lists (list of numpy.ndarray): a (num_edges x 2) array of (source, target)
+        node IDs for each graph, using the same node IDs for all graphs
+
+    Returns:
+    - edge_codes (list of numpy.ndarray): the uint64 encoded edges of each graph
+    """
+    edge_codes = []
+    for edges in edge_lists:
+        edges = edges.astype(np.uint64)
+        edge_codes.append((edges[:, 0] << np.uint64(32)) | edges[:, 1])
+    return edge_codes
+
+
+def build_edge_matrix(edge_codes):
+    """
+    Build a binary matrix indicating which edges are present in each graph.
+
+    Parameters:
+    - edge_codes (list of numpy.ndarray): The encoded edges of each graph, see
+        encode_edges().
+
+    Returns:
+    - edge_matrix (scipy.sparse.csr_matrix): A sparse (num_graphs x num_unique_edges)
+        int32 matrix where edge_matrix[i, j] = 1 if the j-th unique edge is in the
+        i-th graph. Only the edges of each graph are stored, so its memory grows
+        with the total number of edges rather than graphs x unique edges.
+    """
+    # Map each unique edge to a column of the matrix
+    unique_edges, columns = np.unique(np.concatenate(edge_codes), return_inverse=True)
+    rows = np.repeat(np.arange(len(edge_codes)), [len(codes) for codes in edge_codes])
+    edge_matrix = sparse.csr_matrix(
+        (np.ones(len(columns), dtype=np.int32), (rows, columns)),
+        shape=(len(edge_codes), len(unique_edges)),
+    )
+    return edge_matrix
+
+
+def get_jaccard_mismatched(edge_matrix, first_vs_rest=False):
+    """
+    Calculate Jaccard similarity and proportion of mismatched parents between pairs of
+    edge sets.
+
+    Notes: Intersection sizes for all pairs come from a single sparse matrix product,
+        the union size is then |g1| + |g2| - intersection and the number of edges in g1 but
+        not g2 is |g1| - intersection.
+
+    Parameters:
+    - edge_matrix (scipy.sparse.csr_matrix): A binary (num_graphs x num_unique_edges)
+        matrix, see build_edge_matrix().
+    - first_vs_rest (bool): If True, compare the first edge set (g1) to each of the
+        others (g2). Otherwise compare all pairs of edge sets, in the same order as
+        itertools.combinations.
+
+    Returns:
+    - jaccard_similarity (numpy.ndarray): The Jaccard similarity for each pair of edge sets.
+    - prop_mismatched_parents (numpy.ndarray): The proportion of mismatched parents for each
+        pair of edge sets.
+    """
+    num_edges = edge_matrix.getnnz(axis=1).astype(np.int64)
+    if first_vs_rest:
+        intersection_edges_size = (
+            (edge_matrix[1:] @ edge_matrix[0].T).toarray().ravel().astype(np.int64)
+        )
+        g1_num_edges = num_edges[0]
+        g2_num_edges = num_edges[1:]
+    else:
+        # Only a (num_graphs x num_graphs) matrix is made dense
+        all_intersections = (edge_matrix @ edge_matrix.T).toarray().astype(np.int64)
+        g1_idx, g2_idx = np.triu_indices(edge_matrix.shape[0], k=1)
+        intersection_edges_size = all_intersections[g1_idx, g2_idx]
+        g1_num_edges = num_edges[g1_idx]
+        g2_num_edges = num_edges[g2_idx]
+
     # Denominators for later
-    edges_union_size = len(g1_edge_set.union(g2_edge_set))
-    num_edges = len(g1_edge_set)  # Equal for both cascade versions
+    edges_union_size = g1_num_edges + g2_num_edges - intersection_edges_size
 
     # Levenshtein distance, since node set is necessarily equal
-    disjoint_edges_size = len(g1_edge_set.difference(g2_edge_set))
-
-    intersection_edges_size = len(g1_edge_set.intersection(g2_edge_set))
+    disjoint_edges_size = g1_num_edges - intersection_edges_size
 
-    # Calculate and save for each comparison
+    # Calculate for each comparison
     jaccard_similarity = intersection_edges_size / edges_union_size
-    prop_mismatched_parents = disjoint_edges_size / num_edges
+    prop_mismatched_parents = disjoint_edges_size / g1_num_edges
 
     return jaccard_similarity, prop_mismatched_parents
 
 
+def compare_cascade_versions(task):
+    """
+    Calculate the similarity metrics for all comparisons of a single cascade.
+
+    Parameters:
+    - task (tuple): (cascade_path, tid_edge_list) where cascade_path is the path to
+        the cascade's pickled list of version graphs, and tid_edge_list is the
+        (names, edges) of the TID cascade to compare each version to. If
+        tid_edge_list is None, all versions are compared to one another.
+
+    Returns:
+    - None if the cascade only has one version, otherwise a tuple with:
+        - size (int): size of the cascade (number of nodes)
+        - jaccard_list (numpy.ndarray): The Jaccard similarity of each comparison.
+        - prop_mismatched_list (numpy.ndarray): The proportion of mismatched parents
+            of each comparison.
+    """
+    cascade_path, tid_edge_list = task
+
+    # Load all versions of a cascade
+    names, edge_lists = read_cascade_edges(cascade_path)
+
+    # Skip cascades with only one version (length == 2)
+    if len(edge_lists) == 1:
+        return None
+    size = len(names)
+
+    if tid_edge_list is not None:
+        # Compare each graph version to the TID cascade
+        edge_lists.insert(0, map_edge_list(names, tid_edge_list))
+    # Otherwise, compare all versions to one another
+    edge_matrix = build_edge_matrix(encode_edges(edge_lists))
+
+    jaccard_list, prop_mismatched_list = get_jaccard_mismatched(
+        edge_matrix, first_vs_rest=tid_edge_list is not None
+    )
+    return size, jaccard_list, prop_mismatched_list
+
+
+def add_summary_statistics(summary_stats, batch, rng):
+    """
+    Add the mean and bootstrapped 95% confidence intervals of each metric for a batch
+    of cascades.
+
+    Notes: All cascades in the batch must have the same number of comparisons so
+        their comparisons can be stacked into one matrix. The means of every cascade
+        are then a single reduction, and the bootstraps share one set of resampling
+        weights, computing every cascade's bootstrap means with a single matrix product.
+
+    Parameters:
+    - summary_stats (numpy.ndarray): A (len(SUMMARY_STAT_COLUMNS) x num_cascades) array
+        of the statistics of each cascade, updated in place.
+    - batch (list of tuple): (cascade_index, comparisons) pairs, where cascade_index is
+        the cascade's column in summary_stats and comparisons is an
+        (num_comparisons x 2) array of jaccard and prop_mismatched values.
+    - rng (numpy.random.Generator): the random number generator for the bootstraps
+
+    Returns:
+    - None
+    """
+    cascade_idxs, comparisons = zip(*batch)
+    # Columns alternate between jaccard and prop_mismatched for each cascade
+    comparisons = np.hstack(comparisons)
+    means = comparisons.mean(axis=0)
+    # Default is 1000 resamples
+    ci_low, ci_high = bootstrap_ci(comparisons, rng=rng)
+    summary_stats[:, list(cascade_idxs)] = [
+        means[0::2],
+        means[1::2],
+        ci_low[0::2],
+        ci_high[0::2],
+        ci_low[1::2],
+        ci_high[1::2],
+    ]
+
+
 if __name__ == "__main__":
     args = parse_args()
     tid = args.tid
@@ -119,20 +366,38 @@ if __name__ == "__main__":
         raise Exception("Not implemented yet! Must update for new midterm data!")
     cascade_dir_base = os.path.join(REC_DATA_DIR, cascade_type)
 
+    fname_ending = "vs_tid_version" if tid else "vs_pdi_versions"
+    fname = f"cascade_similarity_metrics_{fname_ending}_{gamma_dir}_{alpha_dir}.parquet"
+    output_path = os.path.join(OUTPUT_DIR, fname)
+    if os.path.exists(output_path):
+        print(f"{fname} already exists, skipping.")
+        sys.exit(0)
+
+    alpha_path = os.path.join(cascade_dir_base, gamma_dir, alpha_dir)
+    # Each cascade's versions are stored in one {cascade_id}.pkl file
+    with os.scandir(alpha_path) as entries:
+        cascade_ids = [
+            entry.name.removesuffix(".pkl")
+            for entry in entries
+            if entry.name.endswith(".pkl")
+        ]
+    num_cascades = len(cascade_ids)
+
     if tid:
         tid_files = sorted(
             glob.glob(os.path.join(REC_DATA_DIR, "time_inferred_diffusion/*pkl"))
         )
-        tid_graphs = {}
+        # Only the edge lists of the TID cascades being compared are needed. They
+        # are extracted once here and the graphs are dropped.
+        compared_cascade_ids = set(cascade_ids)
+        tid_edge_lists = {}
         for file in tid_files:
             with open(file, "rb") as f:
                 graph_list = pkl.load(f)
                 for graph in graph_list:
-                    tid_graphs[graph.cascade_id] = graph
-
-    alpha_path = os.path.join(cascade_dir_base, gamma_dir, alpha_dir)
-    cascade_ids = os.listdir(alpha_path)
-    num_cascades = len(cascade_ids)
+                    if graph.cascade_id in compared_cascade_ids:
+                        tid_edge_lists[graph.cascade_id] = get_edge_list(graph)
+            del graph_list
 
     # Handles symbolic link weirdness, if present.
     alpha_path = Path(alpha_path).resolve()
@@ -141,73 +406,69 @@ if __name__ == "__main__":
     alpha_val = float(".".join(alpha_dir.split("_")[1:]))
     print(f"Working on (gamma, alpha): ({gamma_val}, {alpha_val})...")
 
-    records = []
-    for cas_num, cascade_id in enumerate(cascade_ids, start=1):
-        print(f"\t- {cascade_id} ({cas_num} / {num_cascades})")
-
-        # Get all cascade version files
-        cas_dir = os.path.join(alpha_path, cascade_id)
-        cascade_version_files = sorted(os.listdir(cas_dir))
-
-        # Skip cascades with only one version (length == 2)
-        if len(cascade_version_files) == 1:
-            continue
-
-        # Load all versions of a cascade
-        edge_sets = []
-        for cas_version in cascade_version_files:
-            cas_version_path = os.path.join(cas_dir, cas_version)
-            graph = Graph.Read_GraphMLz(cas_version_path)
-            # Create edge set using 'names' (tids)
-            # Using 'names' is more explicit as the vertex indices (which count up from 0)
-            # many not match across cascade versions
-            g_edge_set = set(
-                (e.source_vertex["name"], e.target_vertex["name"]) for e in graph.es
-            )
-            edge_sets.append(g_edge_set)
-
-        if tid:
-            # Compare each graph version to the TID cascade
-            tid_graph = tid_graphs[cascade_id]
-            # Create edge set using 'names' (tids)
-            tid_edge_set = set(
-                (e.source_vertex["name"], e.target_vertex["name"]) for e in tid_graph.es
-            )
-            edge_sets_comparisons = [(tid_edge_set, e) for e in edge_sets]
-        else:
-            # Compare all versions to one another
-            edge_sets_comparisons = list(combinations(edge_sets, 2))
-
-        jaccard_list = []
-        prop_mismatched_list = []
-        for e1, e2 in edge_sets_comparisons:
-            jaccard, prop_mismatched = get_jaccard_mismatched(e1, e2)
-            jaccard_list.append(jaccard)
-            prop_mismatched_list.append(prop_mismatched)
-
-        # Bootstrap 95% confidence intervals (default is 1000 resamples)
-        jaccard_ci_low, jaccard_ci_high = bootstrap_ci(jaccard_list)
-        prop_mismatch_ci_low, prop_mismatch_ci_high = bootstrap_ci(prop_mismatched_list)
-        records.append(
-            {
-                "gamma": gamma_val,
-                "alpha": alpha_val,
-                "cascade_id": cascade_id,
-                "size": graph.vcount(),
-                "jaccard_mean": np.mean(jaccard_list),
-                "prop_mismatched_parents_mean": np.mean(prop_mismatched_list),
-                "jaccard_ci_low": jaccard_ci_low,
-                "jaccard_ci_hi": jaccard_ci_high,
-                "prop_mismatched_parents_ci_low": prop_mismatch_ci_low,
-                "prop_mismatched_parents_ci_high": prop_mismatch_ci_high,
-            }
+    # One task per cascade, processed in parallel
+    tasks = [
+        (
+            os.path.join(alpha_path, f"{cascade_id}.pkl"),
+            tid_edge_lists[cascade_id] if tid else None,
         )
+        for cascade_id in cascade_ids
+    ]
+
+    # Accumulate each column on its own rather than a dict per row. The summary
+    # statistics are filled in by batch, so they get a preallocated array.
+    result_cascade_ids = []
+    result_sizes = array("q")
+    summary_stats = np.empty((len(SUMMARY_STAT_COLUMNS), num_cascades))
+    pending_batches = defaultdict(list)
+    # One generator is reused for the bootstraps of every batch
+    rng = np.random.default_rng()
+    with Pool(N_PROCS) as pool:
+        all_results = pool.imap(compare_cascade_versions, tasks, chunksize=CHUNKSIZE)
+        for cas_num, (cascade_id, result) in enumerate(
+            zip(cascade_ids, all_results), start=1
+        ):
+            print(f"\t- {cascade_id} ({cas_num} / {num_cascades})")
+            if result is None:
+                continue
+            size, jaccard_list, prop_mismatched_list = result
+
+            result_cascade_ids.append(cascade_id)
+            result_sizes.append(size)
+
+            # Means and bootstrapped 95% confidence intervals are calculated in
+            # batches of cascades with the same number of comparisons
+            num_comparisons = len(jaccard_list)
+            pending_batches[num_comparisons].append(
+                (
+                    len(result_cascade_ids) - 1,
+                    np.column_stack([jaccard_list, prop_mismatched_list]),
+                )
+            )
+            if len(pending_batches[num_comparisons]) == BOOTSTRAP_BATCH_SIZE:
+                add_summary_statistics(
+                    summary_stats, pending_batches.pop(num_comparisons), rng
+                )
+
+    for batch in pending_batches.values():
+        add_summary_statistics(summary_stats, batch, rng)
 
     print(f"Saving cascade stats for...")
     print(f"\t- gamma = {gamma_val}, alpha = {alpha_val}...")
     # Save results as parquet (we do not lose intermediate results!)
-    similarity_df = pd.DataFrame.from_records(records)
-    fname_ending = "vs_tid_version" if tid else "vs_pdi_versions"
-    fname = f"cascade_similarity_metrics_{fname_ending}_{gamma_dir}_{alpha_dir}.parquet"
-    similarity_df.to_parquet(os.path.join(OUTPUT_DIR, fname))
+    num_results = len(result_cascade_ids)
+    similarity_table = pa.table(
+        {
+            "gamma": np.full(num_results, gamma_val),
+            "alpha": np.full(num_results, alpha_val),
+            "cascade_id": result_cascade_ids,
+            "size": np.asarray(result_sizes),
+            **{
+                col: summary_stats[row, :num_results]
+                for row, col in enumerate(SUMMARY_STAT_COLUMNS)
+            },
+        },
+        schema=OUTPUT_SCHEMA,
+    )
+    pq.write_table(similarity_table, output_path, compression="zstd")
     print("--- Script complete ---")
@@ -14,16 +14,19 @@ Output:
     - Cascades out output to the output/reconstructed_data directory.
         - The output directory will contain subdirectories that indicate the creation parameters
             utilized (gamma and alpha).
-        - Inside those subdirectories, a directory will be created based on the cascade ID
-        - Files inside the cascade ID directory (GMLz format) will represent different versions
-            of that cascade ID and will be zfilled and numbered 001, 002, ... 100.
-    - E.g., the structure below shows 100 versions of cascade 1:
+        - Inside those subdirectories, a single pickle file will be created for each
+            cascade ID, named after the (zfilled) cascade ID.
+        - Each file contains a list of graphs, the different versions of that cascade ID
+            (version 1, 2, ... 100 in list order). The cascade ID and creation parameters
+            are added as attributes to each graph and can be accessed via
+            `graph.cascade_id`, `graph.alpha` and `graph.gamma`.
+    - E.g., the structure below shows the files of cascades 1, 2 and 3:
         ```
-        `00001/`
-        |- v_001.gmlz
-        |- v_002.gmlz
+        `alpha_1_1/`
+        |- 00001.pkl
+        |- 00002.pkl
+        |- 00003.pkl
         |- ...
-        |- v_100.gmlz
         ```
 Authors:
 - Francesco Pierri
@@ -37,6 +40,7 @@ import warnings
 
 import numpy as np
 import pandas as pd
+import pickle as pkl
 
 from igraph import Graph
 from joblib import Parallel, delayed
@@ -47,6 +51,10 @@ from pkg import reconstruction
 N_SIMULATIONS = 100
 N_PROCS = multiprocessing.cpu_count()
 
+# Cascades with fewer tweets than this are reconstructed in the main process, as
+# sending them to the workers takes longer than reconstructing them
+MIN_PARALLEL_TWEETS = 200
+
 DATA_DIR = "../../cleaned_data"
 OUT_DIR = "/data_volume/cascade_reconstruction"
 
@@ -71,50 +79,36 @@ def parse_args():
     return args
 
 
-def entire_cascade_reconstruction(
-    poten_edge_users, poten_edge_tstamps, poten_edge_fcounts, gamma, alpha, xmin
+def reconstruct_versions(
+    num_versions,
+    poten_edge_users,
+    poten_edge_tstamps,
+    poten_edge_fcounts,
+    gamma,
+    alpha,
+    xmin,
 ):
     """
-    Function to reconstruct a single cascade using pkg library.
+    Reconstruct several versions of a single cascade in one task, so the cascade's
+    data is only sent to a worker once for all of them.
 
     Parameters:
     ----------
-    - Same as reconstruction.get_who_rtd_whom() from local package.
+    - num_versions (int) : the number of cascade versions to reconstruct
+    - Others are the same as reconstruction.entire_cascade_reconstruction() from
+        local package.
 
     Returns:
     ----------
-    - edge_list (list) : list of tuples representing a directed graph's edges
-        - Format will be (source, target) or (parent_tid, retweeter_tid)
+    - edge_arrays (list) : list of `num_versions` edge arrays, each of which is
+        returned by reconstruction.entire_cascade_reconstruction()
     """
-    # Must be true so we save the calculation below
-    edge_list = [(poten_edge_users[0], poten_edge_users[1])]
-
-    # Iterate over all retweets (but the root and first RT) to infer the parent
-    num_retweets = len(poten_edge_tstamps)
-    for idx in range(2, num_retweets):
-        # Get the timestamp and tweet ID for the retweeter
-        retweeter_tstamp = poten_edge_tstamps[idx]
-        retweeter_tid = poten_edge_users[idx]
-
-        # Extract lists related to the potential parents
-        potential_tstamps = np.array(poten_edge_tstamps[:idx])
-        potential_parents = poten_edge_users[:idx]  # These are tweet IDs
-        potential_parents_fcounts = poten_edge_fcounts[:idx]
-
-        # Infer parent
-        inferred_parent = reconstruction.get_who_rtd_whom(
-            poten_edge_users=potential_parents,
-            poten_edge_tstamps=potential_tstamps,
-            poten_edge_fcounts=potential_parents_fcounts,
-            curr_tstamp=retweeter_tstamp,
-            gamma=gamma,
-            alpha=alpha,  # can be determined by the fitting
-            xmin=xmin,  # this should be 1, representing one second
+    return [
+        reconstruction.entire_cascade_reconstruction(
+            poten_edge_users, poten_edge_tstamps, poten_edge_fcounts, gamma, alpha, xmin
         )
-
-        # Should be (source, target)
-        edge_list.append((inferred_parent, retweeter_tid))
-    return edge_list
+        for _ in range(num_versions)
+    ]
 
 
 if __name__ == "__main__":
@@ -131,105 +125,149 @@ if __name__ == "__main__":
     # Load data
     data = pd.read_parquet(os.path.join(DATA_DIR, "clean_raw_data_anon.parquet"))
 
-    # Converting tweet_date to datetime (and sorting by cascade_id just for sake of aesthetics)
-    data["tweet_date"] = data.tweet_date.dt.to_pydatetime()
-    data.sort_values("cascade_id", ascending=True, inplace=True)
+    # Sorting by cascade_id (just for sake of aesthetics) and then by tweet_date, so
+    # the rows of each cascade are temporally ordered
+    data.sort_values(["cascade_id", "tweet_date"], ascending=True, inplace=True)
 
     all_cascades = list(data["cascade_id"].unique())
     num_cascades = len(all_cascades)
 
-    for gamma in GAMMA_VALUES:
-        gamma_dir = os.path.join(out_dir, f"gamma_{gamma}".replace(".", "_"))
-
-        print("#" * 50)
-        print(f"gamma = {gamma}".upper())
-        print("#" * 50)
+    # Store each cascade as temporally ordered tweet IDs, timestamps (in seconds)
+    # and follower counts, found in a single pass over the data
+    tids_arr = data["tid"].to_numpy()
+    tstamps_arr = data["tweet_date"].to_numpy(dtype="datetime64[s]").astype(np.int64)
+    fcounts_arr = data["user_followers"].to_numpy(dtype=np.float64)
+    cascade_arrays = dict()
+    for cascade_id, row_idxs in data.groupby("cascade_id", sort=False).indices.items():
+        cascade_arrays[cascade_id] = (
+            tids_arr[row_idxs],
+            tstamps_arr[row_idxs],
+            fcounts_arr[row_idxs],
+        )
 
-        for alpha in ALPHA_VALUES:
-            alpha_dir = os.path.join(gamma_dir, f"alpha_{alpha}".replace(".", "_"))
+    # A single pool of workers is reused for every cascade, so the workers are only
+    # started once. Using joblib (https://joblib.readthedocs.io/en/latest/) ----> much faster
+    with Parallel(n_jobs=N_PROCS, backend="loky") as parallel:
+        for gamma in GAMMA_VALUES:
+            gamma_dir = os.path.join(out_dir, f"gamma_{gamma}".replace(".", "_"))
 
             print("#" * 50)
-            print(f"alpha = {alpha}".upper())
+            print(f"gamma = {gamma}".upper())
             print("#" * 50)
 
-            # Skip completed alpha levels
-            if os.path.exists(alpha_dir):
-                num_cascade_dirs = len(os.listdir(alpha_dir))
-                if num_cascade_dirs == num_cascades:
-                    print(f"We are reconstructing {num_cascades} cascades.")
-                    print(f"Cascade directories in {alpha_dir}: {num_cascade_dirs}")
-                    print("All cascades generated. Skipping...")
-                    continue
-                else:
-                    print(f"We are reconstructing {num_cascades} cascades.")
-                    print(f"Cascade directories in {alpha_dir}: {num_cascade_dirs}")
-                    print("Some cascades not generated so we continue...")
-
-            for cas_num, cascade_id in enumerate(all_cascades, start=1):
-                print(f"Working on cascade: {cascade_id} ({cas_num}/{num_cascades})...")
-                cascade_dir = os.path.join(alpha_dir, cascade_id.zfill(5))
-                if os.path.exists(cascade_dir) and len(os.listdir(cascade_dir)) == 100:
-                    print(f"\t - Directory <{cascade_dir}> already exists. Skipping...")
-                    continue
-                os.makedirs(cascade_dir, exist_ok=True)
-
-                # Select a single cascades data
-                cascade_frame = data[data["cascade_id"] == cascade_id]
-
-                cascade_frame = cascade_frame.sort_values("tweet_date", ascending=True)
-
-                num_tweets = len(cascade_frame)
-                print(f"\t - Number of tweets: {num_tweets:,}")
-
-                # We only need to generate one version of cascades len 2 because we are not guessing.
-                num_cascade_versions = 1 if (num_tweets == 2) else N_SIMULATIONS
-
-                # Create lists for the function below
-                poten_edge_users = list(cascade_frame["tid"])
-                poten_edge_tstamps = [
-                    int(dt.timestamp()) for dt in cascade_frame.tweet_date
-                ]
-                poten_edge_fcounts = np.array(cascade_frame["user_followers"])
-
-                ## Using joblib (https://joblib.readthedocs.io/en/latest/) ----> much faster
-                backend = "loky"
-                edge_lists = Parallel(n_jobs=N_PROCS, backend=backend)(
-                    delayed(entire_cascade_reconstruction)(
-                        poten_edge_users,
+            for alpha in ALPHA_VALUES:
+                alpha_dir = os.path.join(gamma_dir, f"alpha_{alpha}".replace(".", "_"))
+
+                print("#" * 50)
+                print(f"alpha = {alpha}".upper())
+                print("#" * 50)
+
+                # Cascade files that already exist, found with a single directory scan
+                os.makedirs(alpha_dir, exist_ok=True)
+                with os.scandir(alpha_dir) as entries:
+                    existing_fnames = {
+                        entry.name for entry in entries if entry.name.endswith(".pkl")
+                    }
+
+                # Skip completed alpha levels
+                if existing_fnames:
+                    num_cascade_files = len(existing_fnames)
+                    if num_cascade_files == num_cascades:
+                        print(f"We are reconstructing {num_cascades} cascades.")
+                        print(f"Cascade files in {alpha_dir}: {num_cascade_files}")
+                        print("All cascades generated. Skipping...")
+                        continue
+                    else:
+                        print(f"We are reconstructing {num_cascades} cascades.")
+                        print(f"Cascade files in {alpha_dir}: {num_cascade_files}")
+                        print("Some cascades not generated so we continue...")
+
+                for cas_num, cascade_id in enumerate(all_cascades, start=1):
+                    print(
+                        f"Working on cascade: {cascade_id} ({cas_num}/{num_cascades})..."
+                    )
+                    cascade_fname = f"{cascade_id.zfill(5)}.pkl"
+                    cascade_path = os.path.join(alpha_dir, cascade_fname)
+                    if cascade_fname in existing_fnames:
+                        print(f"\t - File <{cascade_path}> already exists. Skipping...")
+                        continue
+
+                    # Select a single cascades data
+                    (
+                        cascade_tids,
                         poten_edge_tstamps,
                         poten_edge_fcounts,
-                        gamma,
-                        alpha,
-                        XMIN,
-                    )
-                    for _ in range(num_cascade_versions)
-                )
-
-                # Save each version as it's own graph file
-                for vnum, edge_list in enumerate(edge_lists, start=1):
-                    # Create the graph, store cascade ID and creation parameters
-                    g = Graph(directed=True)
-                    g.cascade_id = cascade_id
-                    g.alpha = alpha
-                    g.gamma = gamma
-
-                    # Generate vertex set
-                    all_vertices = set()
-                    for source, target in edge_list:
-                        all_vertices.add(source)
-                        all_vertices.add(target)
-
-                    # Add vertices and edges
-                    g.add_vertices(list(all_vertices))
-                    g.add_edges(edge_list)
-
-                    # Create the correct directory and filename
-                    output_path_fname = os.path.join(
-                        cascade_dir, f"v_{str(vnum).zfill(3)}.gmlz"
-                    )
-
-                    # Write the compressed graphml file for each cascade version
-                    g.write(output_path_fname, format="graphmlz")
+                    ) = cascade_arrays[cascade_id]
+
+                    num_tweets = len(cascade_tids)
+                    print(f"\t - Number of tweets: {num_tweets:,}")
+
+                    # We only need to generate one version of cascades len 2 because we are not guessing.
+                    num_cascade_versions = 1 if (num_tweets == 2) else N_SIMULATIONS
+
+                    # The compiled reconstruction functions work with integer IDs, so
+                    # each tweet is identified by its temporal position in the cascade
+                    poten_edge_users = np.arange(num_tweets, dtype=np.int64)
+
+                    if num_tweets < MIN_PARALLEL_TWEETS:
+                        edge_arrays = reconstruct_versions(
+                            num_cascade_versions,
+                            poten_edge_users,
+                            poten_edge_tstamps,
+                            poten_edge_fcounts,
+                            gamma,
+                            alpha,
+                            XMIN,
+                        )
+                    else:
+                        # Split the versions into one batch per worker
+                        batch_sizes = [
+                            num_cascade_versions // N_PROCS
+                            + (worker < num_cascade_versions % N_PROCS)
+                            for worker in range(N_PROCS)
+                        ]
+                        edge_array_batches = parallel(
+                            delayed(reconstruct_versions)(
+                                batch_size,
+                                poten_edge_users,
+                                poten_edge_tstamps,
+                                poten_edge_fcounts,
+                                gamma,
+                                alpha,
+                                XMIN,
+                            )
+                            for batch_size in batch_sizes
+                            if batch_size > 0
+                        )
+                        edge_arrays = [
+                            edge_array
+                            for edge_array_batch in edge_array_batches
+                            for edge_array in edge_array_batch
+                        ]
+
+                    # Store all versions of the cascade in one list of graphs. Vertex i
+                    # is the tweet at temporal position i, so the edge arrays are used
+                    # as is. Every version has the same vertices, so they are created
+                    # (and named by tweet ID) once and copied for each version.
+                    template = Graph(n=num_tweets, directed=True)
+                    template.vs["name"] = cascade_tids.tolist()
+                    graph_list = []
+                    for edge_array in edge_arrays:
+                        # Create the graph, store cascade ID and creation parameters
+                        g = template.copy()
+                        g.add_edges(edge_array.tolist())
+                        g.cascade_id = cascade_id
+                        g.alpha = alpha
+                        g.gamma = gamma
+
+                        graph_list.append(g)
+
+                    # Write to a temporary file first so an interrupted run never
+                    # leaves a partially written cascade file behind.
+                    tmp_cascade_path = f"{cascade_path}.tmp"
+                    with open(tmp_cascade_path, "wb") as pickle_file:
+                        pkl.dump(graph_list, pickle_file, protocol=5)
+                    os.replace(tmp_cascade_path, cascade_path)
 
     print("#" * 50)
     print(f"Script complete!")
@@ -17,10 +17,12 @@ Output:
 Authors:
 - Matthew DeVerna
 """
+
 import argparse
 import glob
 import os
 
+import numpy as np
 import pandas as pd
 import pickle as pkl
 
@@ -69,26 +71,31 @@ if __name__ == "__main__":
     cascade_ids = data.cascade_id.unique()
     num_cascades = len(cascade_ids)
 
+    # Row positions of each cascade, found in a single pass over the data
+    cascade_rows = data.groupby("cascade_id", sort=False).indices
+    tids_arr = data["tid"].to_numpy()
+    parent_tids_arr = data["parent_tid"].to_numpy()
+
     cas_file_num = 1
     for cas_num, cascade_id in enumerate(cascade_ids, start=1):
         print(f"\t- Generating cascade {cascade_id} ({cas_num}/{num_cascades})...")
-        one_cascade = data[data.cascade_id == cascade_id].copy()
-
-        vertices = set()
-        edge_list = []
-        for idx, row_data in one_cascade.iterrows():
-            vertices.add(row_data.tid)
+        row_idxs = cascade_rows[cascade_id]
+        tids = tids_arr[row_idxs]
+        parent_tids = parent_tids_arr[row_idxs]
 
-            # This means they are the root, and don't have a parent
-            if row_data.parent_tid == "-1":
-                continue
+        # Sorted, so vertex order is the same on every run
+        vertices = np.unique(tids)
 
-            edge_list.append((row_data.parent_tid, row_data.tid))
+        # Roots don't have a parent (parent_tid == "-1")
+        has_parent = parent_tids != "-1"
+        edge_list = list(
+            zip(parent_tids[has_parent].tolist(), tids[has_parent].tolist())
+        )
 
         # Create graph, add vertices, add edges
         g = Graph(directed=True)
         g.cascade_id = cascade_id
-        g.add_vertices(list(vertices))
+        g.add_vertices(vertices.tolist())
         g.add_edges(edge_list)
 
         # Store graph in list
@@ -100,7 +107,7 @@ if __name__ == "__main__":
             print(f"\t- Saving {fname}...")
             output_path_fname = os.path.join(outdir, fname)
             with open(output_path_fname, "wb") as pickle_file:
-                pkl.dump(graph_list, pickle_file)
+                pkl.dump(graph_list, pickle_file, protocol=5)
             cas_file_num += 1
             graph_list = []
 
@@ -109,6 +116,6 @@ if __name__ == "__main__":
     print(f"\t- Saving {fname}...")
     output_path_fname = os.path.join(outdir, fname)
     with open(output_path_fname, "wb") as pickle_file:
-        pkl.dump(graph_list, pickle_file)
+        pkl.dump(graph_list, pickle_file, protocol=5)
 
     print("Script complete.")
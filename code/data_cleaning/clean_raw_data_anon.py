@@ -25,8 +25,9 @@ import os
 
 import numpy as np
 import pandas as pd
-
-from copy import deepcopy
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
 
 # The directory where the raw data is stored
 DATA_DIR = "../../vosoughi_replication_code/data/chunked_raw_data_anon/"
@@ -41,6 +42,28 @@ VERACITY_MAP = {
     "r_33": None,
     "r_45": None,
 }
+# Values read as missing. These are the pandas.read_csv() defaults.
+NA_VALUES = [
+    "",
+    "#N/A",
+    "#N/A N/A",
+    "#NA",
+    "-1.#IND",
+    "-1.#QNAN",
+    "-NaN",
+    "-nan",
+    "1.#IND",
+    "1.#QNAN",
+    "<NA>",
+    "N/A",
+    "NA",
+    "NULL",
+    "NaN",
+    "None",
+    "n/a",
+    "nan",
+    "null",
+]
 
 
 # Create an ArgumentParser object
@@ -61,42 +84,31 @@ def parse_args():
 def load_raw_data(dir, matching_string):
     """
     Load the raw data.
+
+    Notes: Files are parsed into Arrow tables (in parallel threads) and concatenated
+        without copying, so the data is only converted to pandas once.
     """
     files = sorted(glob.glob(os.path.join(dir, matching_string)))
-    # Other columns cannot be set as they contain multiple types of values
-    dtypes = {
-        "tid": str,
-        "cascade_id": str,
-        "parent_tid": str,
-        "user_engagement": float,
-        "cascade_root_tid": str,
+    # Other columns cannot be set as they contain multiple types of values.
+    # tweet_date is kept as a string and converted to datetimes below.
+    column_types = {
+        "tid": pa.string(),
+        "cascade_id": pa.string(),
+        "parent_tid": pa.string(),
+        "user_engagement": pa.float64(),
+        "cascade_root_tid": pa.string(),
+        "tweet_date": pa.string(),
     }
-    data = []
+    convert_options = pv.ConvertOptions(
+        column_types=column_types, null_values=NA_VALUES, strings_can_be_null=True
+    )
+    tables = []
     for file in files:
         print("-" * 50)
         print(f"Loading {os.path.basename(file)}...")
-        data.append(pd.read_csv(file, dtype=dtypes))
+        tables.append(pv.read_csv(file, convert_options=convert_options))
         print("-" * 50)
-    return pd.concat(data).reset_index(drop=True)
-
-
-def map_none(val):
-    """
-    Maps the string value "None" to the None object.
-
-    Parameters:
-    -----------
-    - val (str): The string value to be mapped.
-
-    Returns:
-    -----------
-    - object: The mapped value. If the input value is "None", returns None.
-        Otherwise, returns the input value as is.
-    """
-    if val == "None":
-        return None
-    else:
-        return val
+    return pa.concat_tables(tables).to_pandas(self_destruct=True, split_blocks=True)
 
 
 if __name__ == "__main__":
@@ -120,20 +132,18 @@ if __name__ == "__main__":
     if not keep_all:
         # Ensuring that columns with any 'none' have 'none' strings for all cells
         print("Checking 'None' values are consistent for all rows...".upper())
-        none_str_indices = []
         print(f"Num rows in data: {data.shape[0]:,}")
-        for idx, rowdata in data.iterrows():
-            items = [
-                rowdata.user_account_age,
-                rowdata.user_verified,
-                rowdata.user_followers,
-                rowdata.user_followees,
-            ]
-            if idx % 500_000 == 0:
-                print(f"Rows processed: {idx:,}")
-            if any(x == "None" for x in items):
-                if not all(x == "None" for x in items):
-                    none_str_indices.append(idx)
+        user_columns = [
+            "user_account_age",
+            "user_verified",
+            "user_followers",
+            "user_followees",
+        ]
+        is_none_str = (data[user_columns] == "None").to_numpy()
+        # Rows where some, but not all, of the values are 'None'
+        none_str_indices = np.flatnonzero(
+            is_none_str.any(axis=1) & ~is_none_str.all(axis=1)
+        )
         print(
             f"Number of rows where all values DO NOT == 'None': {len(none_str_indices)}"
         )
@@ -170,7 +180,7 @@ if __name__ == "__main__":
         # shows that if one is None, all are None.
         print("Converting string 'None' values to real Pyhton None values...".upper())
         for col in columns_w_none:
-            data[col] = data[col].apply(map_none)
+            data[col] = data[col].mask(data[col] == "None")
         print(f"\t- Done.")
 
         cascades_w_missing_info = set(data[data.isna().any(axis=1)]["cascade_id"])
@@ -198,7 +208,7 @@ if __name__ == "__main__":
     print(f"\t- Percentage of retweets being dropped: {prop_retweets_to_remove:%}")
 
     print("Dropping rows with missing data...".upper())
-    data = deepcopy(data[~missing_data_boolean].reset_index(drop=True))
+    data = data.loc[~missing_data_boolean].reset_index(drop=True)
 
     print(f"\t- Total retweets remaining: {len(data):,}")
     print("-" * 50)
@@ -208,7 +218,7 @@ if __name__ == "__main__":
         columns_w_none.remove("user_verified")
         for col in columns_w_none:
             print(f"\t-> {col}")
-            data[col] = data[col].map(int)
+            data[col] = data[col].astype(np.int64)
         print(f"\t- Done.")
 
     print("Convert `was_retweeted` to boolean...".upper())
@@ -218,11 +228,9 @@ if __name__ == "__main__":
     if not keep_all:
         print("Dropping cascades with length 1...".upper())
         num_cascades = data["cascade_id"].nunique()
-        lengths = (
-            data.groupby("cascade_id").size().to_frame("cascade_length").reset_index()
-        )
-        cascades = lengths[lengths.cascade_length > 1].cascade_id.to_list()
-        data = data[data["cascade_id"].isin(cascades)]
+        # Each row's cascade length, found in a single groupby pass
+        cascade_lengths = data.groupby("cascade_id")["tid"].transform("size")
+        data = data[cascade_lengths > 1]
         num_cascades_remaining = data["cascade_id"].nunique()
         num_cascades_removed = num_cascades - num_cascades_remaining
         print(f"\t- Total cascades: {num_cascades:,}")
@@ -235,10 +243,14 @@ if __name__ == "__main__":
 
     print("Saving data...".upper())
     if keep_all:
-        # Split data into two frames and save each with prefix version
-        for num, half_frame in enumerate(np.array_split(data, 2)):
-            half_frame.to_parquet(
-                os.path.join(OUT_DIR, f"v_{str(num).zfill(2)}_{fname}")
+        # Split data into two files and save each with prefix version. Slices of
+        # the Arrow table are zero-copy views, so no half frames are created.
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        half_rows = (table.num_rows + 1) // 2
+        for num in range(2):
+            pq.write_table(
+                table.slice(num * half_rows, half_rows),
+                os.path.join(OUT_DIR, f"v_{str(num).zfill(2)}_{fname}"),
             )
     else:
         data.to_parquet(os.path.join(OUT_DIR, fname))
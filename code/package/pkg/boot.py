@@ -7,32 +7,45 @@ Author: Matthew DeVerna
 import numpy as np
 
 
-def bootstrap_ci(array, confidence=0.95, n_samples=1_000, d_only=False):
+def bootstrap_ci(array, confidence=0.95, n_samples=1_000, d_only=False, rng=None):
     """
     Calculate a confidence interval for sample data via bootstrapping
 
+    Notes: Resampling n values with replacement is equivalent to weighting each value
+        by how many times it was drawn, and those counts follow a multinomial
+        distribution. So all bootstrap means are computed at once as W @ array / n,
+        where each row of W holds the counts of one bootstrap sample.
+
     Parameters:
     -----------
-    - array (of ints/floats): the sample data
+    - array (of ints/floats): the sample data. A 2D array (n x k) is treated as k
+        samples of size n that share the same bootstrap resamples.
     - confidence (float): the desired level of confidence (default=0.95)
     - n_samples (float): number of bootstrap samples
     - distance_only (bool): If True, return only half the distance between the
         upper and lower bounds
+    - rng (numpy.random.Generator): the random number generator to draw the bootstrap
+        samples with. Pass the same generator to repeated calls to reuse it. If None
+        (default), numpy's global random state is used.
 
     Returns:
     -----------
     - if d_only = False (tuple): The lower and upper bounds of the confidence interval.
     - if d_only = True (float, Default): Distance from low to high divided by 2
+    - For a 2D array, each bound (or distance) is an array with one value per column
     """
     # Ignore NaN values
+    array = np.asarray(array, dtype=np.float64)
     n = len(array)
-    bootstrapped_means = []
-    for _ in range(n_samples):
-        bootstrap_sample = np.random.choice(a=array, size=n, replace=True)
-        bootstrapped_means.append(np.mean(bootstrap_sample))
+    if rng is None:
+        rng = np.random
+    weights = rng.multinomial(n, np.full(n, 1 / n), size=n_samples)
+    bootstrapped_means = weights.astype(np.float64) @ array / n
     alpha = (1 - confidence) / 2
-    lower_bound = np.percentile(bootstrapped_means, alpha * 100)
-    upper_bound = np.percentile(bootstrapped_means, (1 - alpha) * 100)
+    # Both bounds are found with a single sort of the bootstrapped means
+    lower_bound, upper_bound = np.percentile(
+        bootstrapped_means, [alpha * 100, (1 - alpha) * 100], axis=0
+    )
     if d_only:
         h = (upper_bound - lower_bound) / 2
         return h
@@ -5,21 +5,27 @@ Author: Matthew DeVerna
 """
 import random
 
-import powerlaw
-
 import numpy as np
 import pandas as pd
-import scipy.integrate as integrate
+
+from numba import float64, int64, njit, prange
 
 
 def power_law(z, alpha, xmin=1):
     """
-    Power law function.
+    Probability of the power law falling within a small window around `z`.
         Form: (alpha-1)/xmin)*((xmin/x)**alpha)
+
+    Notes: The PDF is integrated over [z - epsilon, z + epsilon] in closed form,
+        (xmin/(z-epsilon))**(alpha-1) - (xmin/(z+epsilon))**(alpha-1). It is
+        rewritten with expm1() and log1p() so the two nearly equal terms do not
+        cancel out when z is large.
+
     Parameters:
     ----------
-    - z (float): value at which P(z | alpha, xmin) is required. In this script, it will
-        represent the time difference in seconds between two tweets/retweets.
+    - z (float or np.ndarray): value(s) at which P(z | alpha, xmin) is required. In
+        this script, it will represent the time difference in seconds between two
+        tweets/retweets.
     - alpha (float): power law exponent.
         Ref: based on https://en.wikipedia.org/wiki/Power_law
     - xmin (float): minimum value from where power law behavior exists. Default = 1 (second).
@@ -27,15 +33,15 @@ def power_law(z, alpha, xmin=1):
 
     Returns:
     ----------
-    (odeint, ode) (tuple) where:
-        - odeint: General integration of ordinary differential equations. We use this.
-        - ode: Integrate ODE using VODE and ZVODE routines.
-        Reference: https://docs.scipy.org/doc/scipy/reference/tutorial/integrate.html
+    - prob (float or np.ndarray) : the integral of the power law PDF over the
+        window around `z`
     """
 
     epsilon = 0.0001
-    return integrate.quad(
-        lambda x: ((alpha - 1) / xmin) * ((xmin / x) ** alpha), z - epsilon, z + epsilon
+    exponent = alpha - 1
+    return ((xmin / z) ** exponent) * (
+        np.expm1(-exponent * np.log1p(-epsilon / z))
+        - np.expm1(-exponent * np.log1p(epsilon / z))
     )
 
 
@@ -47,6 +53,7 @@ def get_who_rtd_whom(
     gamma,
     alpha,
     xmin,
+    rng=None,
 ):
     """
     Probabilistically infer which user in `poten_edge_users` was retweeted.
@@ -68,31 +75,43 @@ def get_who_rtd_whom(
     - curr_tstamp (int) : the timestamp of tweet X
     - gamma (float) : weight given to the follower-count probability distribition.
         Must be between 0 and 1. 1-gamma is given to the time-difference probability
-        distribution.
+        distribution. If none of the users have any followers, all of the weight is
+        given to the time-difference probability distribution.
     - alpha (float) : alpha value for power-law function
     - xmin (float) : xmin value for power-law function
+    - rng (np.random.Generator) : random number generator used for the draw.
+        Default = None, which draws from the global `np.random` state. Pass one
+        generator per process to keep parallel workers from sharing that state.
 
     Returns:
     ----------
     - retweeted_uid (str) : the user that tweet X retweeted
     """
 
+    # With a single candidate there is nothing to sample
+    if len(poten_edge_users) == 1:
+        return poten_edge_users[0]
+
     # Create an array of probabilities (temporally ordered) for the
     # probability of the user at position `idx` in the cascade, of
     # retweeting everyone prior to position `idx`. Probabilities
     # are proportional to the number of followers a user has relative
     # all others considered
     total_fcounts = sum(poten_edge_fcounts)
-    fcount_probabilities = poten_edge_fcounts / total_fcounts
+    if total_fcounts == 0:
+        # The follower-count distribution is undefined (0/0) when no user has
+        # followers, so only the time-difference distribution is used
+        gamma = 0.0
+        fcount_probabilities = np.zeros(len(poten_edge_fcounts))
+    else:
+        fcount_probabilities = poten_edge_fcounts / total_fcounts
 
     # Now we create an array of probabilities (temporally ordered) based
     # on the number of seconds that have passed since the retweet at
     # position `idx` and all tweets prior to position `idx`. Probability
     # is drawn from a power law function
-    time_diffs = curr_tstamp - poten_edge_tstamps
-    tdiff_probs = np.array(
-        [power_law(tdiff + 0.1, alpha, xmin)[0] for tdiff in time_diffs]
-    )
+    time_diffs = curr_tstamp - np.asarray(poten_edge_tstamps)
+    tdiff_probs = power_law(time_diffs + 0.1, alpha, xmin)
     norm_tstamp_prob_array = tdiff_probs / tdiff_probs.sum()
 
     # Weighted probabilities based on gamma
@@ -102,20 +121,213 @@ def get_who_rtd_whom(
     # Combine the weighted arrays to get the final individual probabilities
     indiv_probs = weighted_fcount + weighted_tstamp
 
-    # Sample a user based on the integration of these two probabilities
-    retweeted_uid = np.random.choice(
-        poten_edge_users,
-        p=indiv_probs,
-    )
+    # Sample a user based on the integration of these two probabilities by
+    # finding where a uniform random draw falls in their cumulative distribution
+    cumulative_probs = np.cumsum(indiv_probs)
+    uniform_draw = np.random.random() if rng is None else rng.random()
+    draw = uniform_draw * cumulative_probs[-1]
+    retweeted_idx = np.searchsorted(cumulative_probs, draw, side="right")
+
+    # A draw equal to the total would land past the last user, so the index is
+    # clamped to the last user like the fallback in _get_who_rtd_whom()
+    retweeted_uid = poten_edge_users[min(retweeted_idx, len(poten_edge_users) - 1)]
 
     return retweeted_uid
 
 
+@njit(
+    int64(int64[:], int64[:], float64[:], int64, float64, float64, float64, float64[:]),
+    cache=True,
+)
+def _get_who_rtd_whom(
+    poten_edge_users,
+    poten_edge_tstamps,
+    poten_edge_fcounts,
+    curr_tstamp,
+    gamma,
+    alpha,
+    xmin,
+    tdiff_probs,
+):
+    """
+    Numba-compiled version of `get_who_rtd_whom()` that operates on numpy arrays.
+
+    Notes: The time-difference probabilities are taken directly from the power law
+        PDF rather than integrating it over a small window with `power_law()`. The
+        probabilities are normalized below, so the constant width of that window
+        cancels out.
+
+    Parameters:
+    -----------
+    - poten_edge_users (np.ndarray[int64]) : temporally ordered user integer IDs
+    - poten_edge_tstamps (np.ndarray[int64]) : temporally ordered timestamps
+    - poten_edge_fcounts (np.ndarray[float64]) : temporally ordered follower counts
+    - curr_tstamp (int) : the timestamp of tweet X
+    - gamma (float) : weight given to the follower-count probability distribition.
+        If none of the users have any followers, it is treated as 0.
+    - alpha (float) : alpha value for power-law function
+    - xmin (float) : xmin value for power-law function. It only scales the
+        time-difference probabilities, so it cancels out when they are normalized.
+    - tdiff_probs (np.ndarray[float64]) : scratch array, at least as long as
+        `poten_edge_users`, that the time-difference probabilities are written to.
+        The caller allocates it once per cascade rather than once per retweet.
+
+    Returns:
+    ----------
+    - retweeted_uid (int) : the integer ID of the user that tweet X retweeted
+    """
+    num_users = poten_edge_users.shape[0]
+
+    total_fcounts = 0.0
+    for i in range(num_users):
+        total_fcounts += poten_edge_fcounts[i]
+
+    # The follower-count distribution is undefined (0/0) when no user has
+    # followers, so only the time-difference distribution is used
+    fcount_weight = gamma
+    if total_fcounts == 0:
+        fcount_weight = 0.0
+        total_fcounts = 1.0
+
+    # Power law PDF of the time difference, ((alpha-1)/xmin)*((xmin/x)**alpha),
+    # without the constant ((alpha-1)/xmin)*(xmin**alpha) that cancels when
+    # normalized. x**(-alpha) is taken as exp(-alpha*log(x)), which is cheaper
+    # than a general float power.
+    total_tdiff_probs = 0.0
+    for i in range(num_users):
+        tdiff = curr_tstamp - poten_edge_tstamps[i] + 0.1
+        tdiff_probs[i] = np.exp(-alpha * np.log(tdiff))
+        total_tdiff_probs += tdiff_probs[i]
+
+    # Walk the cumulative distribution of the gamma-weighted probabilities
+    # until it passes a uniform random draw
+    draw = np.random.random()
+    cumulative_prob = 0.0
+    for i in range(num_users):
+        cumulative_prob += fcount_weight * (poten_edge_fcounts[i] / total_fcounts) + (
+            1 - fcount_weight
+        ) * (tdiff_probs[i] / total_tdiff_probs)
+        if draw < cumulative_prob:
+            return poten_edge_users[i]
+
+    # Only reached if floating point error leaves the total just below one
+    return poten_edge_users[num_users - 1]
+
+
+@njit(
+    int64[:, :](int64[:], int64[:], float64[:], float64, float64, float64),
+    cache=True,
+)
+def entire_cascade_reconstruction(
+    poten_edge_users, poten_edge_tstamps, poten_edge_fcounts, gamma, alpha, xmin
+):
+    """
+    Reconstruct a single cascade with PDI. Compiled with numba.
+
+    Parameters:
+    ----------
+    - poten_edge_users (np.ndarray[int64]) : temporally ordered user integer IDs
+        for all N posts in the cascade (root first). The cascade must have at
+        least two posts (N >= 2).
+    - poten_edge_tstamps (np.ndarray[int64]) : temporally ordered timestamps
+    - poten_edge_fcounts (np.ndarray[float64]) : temporally ordered follower counts
+    - gamma (float) : weight given to the follower-count probability distribition.
+    - alpha (float) : alpha value for power-law function
+    - xmin (float) : xmin value for power-law function
+
+    Returns:
+    ----------
+    - edge_array (np.ndarray[int64]) : (N-1, 2) array of a directed graph's edges
+        - Each row is (source, target) or (parent_id, reposter_id)
+    """
+    num_reposts = poten_edge_tstamps.shape[0]
+    if num_reposts < 2:
+        raise ValueError("A cascade must have at least two posts to reconstruct.")
+    edge_array = np.empty((num_reposts - 1, 2), dtype=np.int64)
+    tdiff_probs = np.empty(num_reposts, dtype=np.float64)
+
+    # Must be true so we save the calculation below
+    edge_array[0, 0] = poten_edge_users[0]
+    edge_array[0, 1] = poten_edge_users[1]
+
+    # Iterate over all reposts (but the root and first RT) to infer the parent
+    for idx in range(2, num_reposts):
+        edge_array[idx - 1, 0] = _get_who_rtd_whom(
+            poten_edge_users[:idx],
+            poten_edge_tstamps[:idx],
+            poten_edge_fcounts[:idx],
+            poten_edge_tstamps[idx],
+            gamma,
+            alpha,
+            xmin,
+            tdiff_probs,
+        )
+        edge_array[idx - 1, 1] = poten_edge_users[idx]
+
+    return edge_array
+
+
+@njit(
+    int64[:, :, :](int64[:], int64[:], float64[:], float64, float64, float64, int64),
+    parallel=True,
+    cache=True,
+)
+def run_versions(
+    poten_edge_users,
+    poten_edge_tstamps,
+    poten_edge_fcounts,
+    gamma,
+    alpha,
+    xmin,
+    n_versions,
+):
+    """
+    Reconstruct `n_versions` versions of a single cascade in parallel threads.
+
+    Notes: Numba keeps a separate random number generator state for each thread,
+        so versions reconstructed in different threads draw independent streams.
+
+    Parameters:
+    ----------
+    - Same as entire_cascade_reconstruction(), including N >= 2.
+    - n_versions (int) : the number of cascade versions to reconstruct
+
+    Returns:
+    ----------
+    - edge_arrays (np.ndarray[int64]) : (n_versions, N-1, 2) array where
+        edge_arrays[v] is the edge array of version v
+    """
+    num_reposts = poten_edge_tstamps.shape[0]
+    if num_reposts < 2:
+        raise ValueError("A cascade must have at least two posts to reconstruct.")
+    edge_arrays = np.empty((n_versions, num_reposts - 1, 2), dtype=np.int64)
+
+    # Each version writes only to its own slice of the output
+    for v in prange(n_versions):
+        edge_arrays[v] = entire_cascade_reconstruction(
+            poten_edge_users,
+            poten_edge_tstamps,
+            poten_edge_fcounts,
+            gamma,
+            alpha,
+            xmin,
+        )
+
+    return edge_arrays
+
+
 def simulate_plaw_fits(arr, sample_size, num_sims, xmin):
     """
     Fit sampled data from an array to a power-law function many times
     and estimate the parameter alpha each time.
 
+    Notes: The xmin value is fixed, so alpha has a closed-form maximum
+        likelihood estimate and a `powerlaw.Fit` object is not needed. The
+        samples for all runs are drawn at once, as one matrix of indices into
+        `arr`, and every run is fit with the same array operations. The
+        generator is seeded from the `random` module, so `random.seed()` still
+        makes the results reproducible.
+
     Parameters:
     -----------
     - arr (array/sequence) : an array of data to be fit to the power-law function
@@ -131,14 +343,22 @@ def simulate_plaw_fits(arr, sample_size, num_sims, xmin):
         - alpha (float) : the estimated alpha value
     """
 
-    estimated_parameters = []
-
-    for run in range(1, num_sims + 1):
-        sample_seconds = random.choices(arr, k=sample_size)
+    # Each row is the sample (drawn with replacement) for one run
+    values = np.asarray(arr, dtype=np.float64)
+    rng = np.random.default_rng(random.getrandbits(64))
+    samples = values[rng.integers(0, values.shape[0], size=(num_sims, sample_size))]
 
-        fit = powerlaw.Fit(sample_seconds, xmin=xmin)
+    # Continuous power law MLE, as reported by powerlaw.Fit(data, xmin=xmin).
+    # Values below xmin are raised to xmin so their log ratio is zero.
+    tail_sizes = (samples >= xmin).sum(axis=1)
+    log_ratio_sums = np.log(np.maximum(samples, xmin) / xmin).sum(axis=1)
+    alphas = 1 + tail_sizes / log_ratio_sums
 
-        estimated_parameters.append((run, fit.power_law.xmin, fit.power_law.alpha))
-
-    est_params_df = pd.DataFrame(estimated_parameters, columns=["run", "xmin", "alpha"])
+    est_params_df = pd.DataFrame(
+        {
+            "run": np.arange(1, num_sims + 1),
+            "xmin": np.full(num_sims, xmin, dtype=np.float64),
+            "alpha": alphas,
+        }
+    )
     return est_params_df
@@ -13,12 +13,15 @@ pip install --upgrade pip
 pip install igraph==0.11.4 \
             joblib==1.4.0 \
             matplotlib==3.8.4 \
+            numba==0.59.1 \
             numpy==1.26.4 \
+            orjson==3.10.7 \
             pandas==2.2.2 \
             pyarrow==16.0.0 \
             scipy==1.13.0 \
             seaborn==0.13.2 \
-            statsmodels==0.14.2
+            statsmodels==0.14.2 \
+            tenacity==9.0.0
 
 echo ""
 echo "Environment creation completed."
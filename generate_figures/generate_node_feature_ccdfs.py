@@ -21,6 +21,8 @@ import glob as glob
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
 
 from matplotlib.lines import Line2D
 from matplotlib.ticker import FuncFormatter
@@ -32,8 +34,10 @@ os.chdir(os.path.dirname(os.path.abspath(__file__)))
 OUTPUT_DIR = "figures"
 METRICS_DIR = "../output/cascade_metrics"
 CAS_DIR_BASE = "../output/reconstructed_data"
-ALPHA_DIRS = ["alpha_1_1", "alpha_1_5", "alpha_2_0", "alpha_2_5", "alpha_3_0"]
-GAMMA_DIRS = ["gamma_0_25", "gamma_0_5", "gamma_0_75"]
+# gamma and alpha are stored as hive partition directories (gamma=0.5/alpha=1.1)
+METRICS_PARTITIONING = ds.partitioning(
+    pa.schema([("gamma", pa.float64()), ("alpha", pa.float64())]), flavor="hive"
+)
 
 
 def myLogFormat(y, pos):
@@ -46,15 +50,15 @@ def myLogFormat(y, pos):
 
 
 print("\nLoading reconstructed data...")
-recon_data_df = []
-for gamma_dir in GAMMA_DIRS:
-    for alpha_dir in ALPHA_DIRS:
-        path = os.path.join(
-            METRICS_DIR,
-            f"cascade_metrics_statistics_{gamma_dir}_{alpha_dir}.parquet",
-        )
-        recon_data_df.append(pd.read_parquet(path))
-recon_data_df = pd.concat(recon_data_df)
+recon_data_df = (
+    ds.dataset(
+        os.path.join(METRICS_DIR, "cascade_metrics_statistics"),
+        format="parquet",
+        partitioning=METRICS_PARTITIONING,
+    )
+    .to_table()
+    .to_pandas()
+)
 
 print("Loading time-inferred data...")
 tid_fname = os.path.join(METRICS_DIR, "time_inferred_diffusion_metrics.parquet")
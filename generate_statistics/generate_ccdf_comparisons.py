@@ -16,6 +16,8 @@ import os
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
 
 import itertools
 from scipy.stats import ks_2samp
@@ -26,8 +28,10 @@ os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
 
 CAS_METS_DIR = "../output/cascade_metrics"
-ALPHA_DIRS = ["alpha_1_1", "alpha_1_5", "alpha_2_0", "alpha_2_5", "alpha_3_0"]
-GAMMA_DIRS = ["gamma_0_25", "gamma_0_5", "gamma_0_75"]
+# gamma and alpha are stored as hive partition directories (gamma=0.5/alpha=1.1)
+METRICS_PARTITIONING = ds.partitioning(
+    pa.schema([("gamma", pa.float64()), ("alpha", pa.float64())]), flavor="hive"
+)
 OUTPUT_DIR = "statistics"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 OUTPUT_FN = "ccdf_comparisons.txt"
@@ -45,15 +49,15 @@ def significance_marker(p):
 
 
 # Load the reconstructed data cascade metric statistics
-recon_data_df = []
-for gamma_dir in GAMMA_DIRS:
-    for alpha_dir in ALPHA_DIRS:
-        path = os.path.join(
-            CAS_METS_DIR,
-            f"cascade_metrics_statistics_{gamma_dir}_{alpha_dir}.parquet",
-        )
-        recon_data_df.append(pd.read_parquet(path))
-recon_data_df = pd.concat(recon_data_df)
+recon_data_df = (
+    ds.dataset(
+        os.path.join(CAS_METS_DIR, "cascade_metrics_statistics"),
+        format="parquet",
+        partitioning=METRICS_PARTITIONING,
+    )
+    .to_table()
+    .to_pandas()
+)
 
 # Load the time inferred diffusion metrics
 tid_fname = os.path.join(CAS_METS_DIR, "time_inferred_diffusion_metrics.parquet")
@@ -31,7 +31,6 @@ Authors:
 - Matthew DeVerna
 """
 
-import multiprocessing
 import os
 import warnings
 
@@ -39,7 +38,6 @@ import numpy as np
 import pandas as pd
 
 from igraph import Graph
-from joblib import Parallel, delayed
 
 # Local project package
 from pkg import reconstruction
@@ -48,7 +46,6 @@ from pkg import reconstruction
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
 N_SIMULATIONS = 100
-N_PROCS = multiprocessing.cpu_count()
 
 
 DATA_FILE = "/data_volume/cascade_reconstruction/temp/cascade_records.parquet"
@@ -62,52 +59,6 @@ ALPHA_VALUES = [1.1, 2.0, 3.0]
 XMIN = 1
 
 
-def entire_cascade_reconstruction(
-    poten_edge_users, poten_edge_tstamps, poten_edge_fcounts, gamma, alpha, xmin
-):
-    """
-    Function to reconstruct a single cascade using pkg library.
-
-    Parameters:
-    ----------
-    - Same as reconstruction.get_who_rtd_whom() from local package.
-
-    Returns:
-    ----------
-    - edge_list (list) : list of tuples representing a directed graph's edges
-        - Format will be (source, target) or (parent_tid, retweeter_tid)
-    """
-    # Must be true so we save the calculation below
-    edge_list = [(poten_edge_users[0], poten_edge_users[1])]
-
-    # Iterate over all retweets (but the root and first RT) to infer the parent
-    num_retweets = len(poten_edge_tstamps)
-    for idx in range(2, num_retweets):
-        # Get the timestamp and tweet ID for the retweeter
-        retweeter_tstamp = poten_edge_tstamps[idx]
-        retweeter_tid = poten_edge_users[idx]
-
-        # Extract lists related to the potential parents
-        potential_tstamps = np.array(poten_edge_tstamps[:idx])
-        potential_parents = poten_edge_users[:idx]  # These are tweet IDs
-        potential_parents_fcounts = poten_edge_fcounts[:idx]
-
-        # Infer parent
-        inferred_parent = reconstruction.get_who_rtd_whom(
-            poten_edge_users=potential_parents,
-            poten_edge_tstamps=potential_tstamps,
-            poten_edge_fcounts=potential_parents_fcounts,
-            curr_tstamp=retweeter_tstamp,
-            gamma=gamma,
-            alpha=alpha,  # can be determined by the fitting
-            xmin=xmin,  # this should be 1, representing one second
-        )
-
-        # Should be (source, target)
-        edge_list.append((inferred_parent, retweeter_tid))
-    return edge_list
-
-
 if __name__ == "__main__":
     warnings.filterwarnings("ignore")
 
@@ -119,6 +70,12 @@ if __name__ == "__main__":
     all_cascades = list(data["cascade_id"].unique())
     num_cascades = len(all_cascades)
 
+    # Row positions of each cascade, found in a single pass over the data
+    cascade_rows = data.groupby("cascade_id", sort=False).indices
+    user_ids_arr = data["user_id"].to_numpy()
+    tstamps_arr = data["timestamp"].to_numpy(dtype=np.int64)
+    fcounts_arr = data["follower_count"].to_numpy(dtype=np.float64)
+
     for gamma in GAMMA_VALUES:
         gamma_dir = os.path.join(OUT_DIR, f"gamma_{gamma}".replace(".", "_"))
 
@@ -154,53 +111,49 @@ if __name__ == "__main__":
                     continue
                 os.makedirs(cascade_dir, exist_ok=True)
 
-                # Select a single cascades data
-                cascade_frame = data[data["cascade_id"] == cascade_id]
-
-                cascade_frame = cascade_frame.sort_values("timestamp", ascending=True)
+                # Select a single cascades rows, temporally ordered
+                row_idxs = cascade_rows[cascade_id]
+                row_idxs = row_idxs[np.argsort(tstamps_arr[row_idxs], kind="stable")]
 
-                num_tweets = len(cascade_frame)
+                num_tweets = len(row_idxs)
                 print(f"\t - Number of tweets: {num_tweets:,}")
 
                 # We only need to generate one version of cascades len 2 because we are not guessing.
                 num_cascade_versions = 1 if (num_tweets == 2) else N_SIMULATIONS
 
-                # Create lists for the function below
-                poten_edge_users = list(cascade_frame["user_id"])
-                poten_edge_tstamps = list(cascade_frame["timestamp"])
-                poten_edge_fcounts = np.array(cascade_frame["follower_count"])
-
-                ## Using joblib (https://joblib.readthedocs.io/en/latest/) ----> much faster
-                backend = "loky"
-                edge_lists = Parallel(n_jobs=N_PROCS, backend=backend)(
-                    delayed(entire_cascade_reconstruction)(
-                        poten_edge_users,
-                        poten_edge_tstamps,
-                        poten_edge_fcounts,
-                        gamma,
-                        alpha,
-                        XMIN,
-                    )
-                    for _ in range(num_cascade_versions)
+                # Each tweet is identified by its position in the cascade, so the
+                # compiled reconstruction works on integer IDs. A user can post
+                # more than once, so the positions are mapped back to users below.
+                cascade_user_ids = user_ids_arr[row_idxs]
+                poten_edge_users = np.arange(num_tweets, dtype=np.int64)
+                poten_edge_tstamps = tstamps_arr[row_idxs]
+                poten_edge_fcounts = fcounts_arr[row_idxs]
+
+                # Versions are reconstructed in parallel threads by numba
+                edge_arrays = reconstruction.run_versions(
+                    poten_edge_users,
+                    poten_edge_tstamps,
+                    poten_edge_fcounts,
+                    gamma,
+                    alpha,
+                    XMIN,
+                    num_cascade_versions,
                 )
 
                 # Save each version as it's own graph file
-                for vnum, edge_list in enumerate(edge_lists, start=1):
+                for vnum, edge_array in enumerate(edge_arrays, start=1):
+                    # Map tweet positions back to the users who posted them
+                    edge_list = cascade_user_ids[edge_array]
+
                     # Create the graph, store cascade ID and creation parameters
                     g = Graph(directed=True)
                     g.cascade_id = cascade_id
                     g.alpha = alpha
                     g.gamma = gamma
 
-                    # Generate vertex set
-                    all_vertices = set()
-                    for source, target in edge_list:
-                        all_vertices.add(source)
-                        all_vertices.add(target)
-
                     # Add vertices and edges
-                    g.add_vertices(list(all_vertices))
-                    g.add_edges(edge_list)
+                    g.add_vertices(np.unique(edge_list).tolist())
+                    g.add_edges(edge_list.tolist())
 
                     # Create the correct directory and filename
                     output_path_fname = os.path.join(
@@ -23,8 +23,9 @@ Author: Matthew DeVerna
 """
 import os
 
+import numpy as np
+
 from collections import defaultdict
-from collections import Counter
 
 from igraph import Graph
 from joblib import Parallel, delayed
@@ -113,34 +114,29 @@ def generate_network(files_to_load, netv):
     - global_net (igraph.Graph): Directed retweet network inclusive of all cascades
     """
     # Load all verticies and edges.
-    # Use "names" (user IDs) to be consistent across cascades
-    all_vertices = set()
+    # Use "names" (user IDs) to be consistent across cascades. Each name is mapped
+    # to a global vertex index so edges can be handled as integers.
+    name_to_idx = dict()
     all_edges = list()
     for file in files_to_load:
         g = Graph.Read_GraphMLz(file)
-        all_vertices.update(g.vs["name"])
-        all_edges.extend(
-            [(g.vs[edge.source]["name"], g.vs[edge.target]["name"]) for edge in g.es]
+        local_to_global = np.array(
+            [name_to_idx.setdefault(name, len(name_to_idx)) for name in g.vs["name"]],
+            dtype=np.int64,
         )
+        local_edges = np.array(g.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+        all_edges.append(local_to_global[local_edges])
+
+    # Unique edges and their weights (number of occurrences) in one pass
+    edges = np.concatenate(all_edges)
+    unique_edges, weights = np.unique(edges, axis=0, return_counts=True)
 
-    # Create the global network and add the vertices and edges
+    # Create the global network and add the vertices and weighted edges
     global_net = Graph(directed=True)
     global_net["version"] = netv
-    global_net.add_vertices(list(all_vertices))
-    global_net.add_edges(list(set(all_edges)))
-
-    # Determine edge weights
-    edge_weight_counter = Counter()
-    for edge in all_edges:
-        edge_weight_counter[edge] += 1
-
-    # Update weights
-    global_net.es["weight"] = [
-        edge_weight_counter[
-            (global_net.vs[edge.source]["name"], global_net.vs[edge.target]["name"])
-        ]
-        for edge in global_net.es
-    ]
+    global_net.add_vertices(list(name_to_idx))
+    global_net.add_edges(unique_edges.tolist())
+    global_net.es["weight"] = weights.tolist()
 
     return global_net
 
@@ -15,7 +15,6 @@ import os
 import numpy as np
 import pandas as pd
 
-from collections import Counter
 from igraph import Graph
 
 
@@ -37,42 +36,34 @@ def generate_naive_network(df):
     -----------
     global_net (igraph.Graph): a naive directed and weighted retweet network
     """
-    all_vertices = set(df["user_id"])
-    all_edges = list()
-
-    # Iterate over unique cascade_ids
-    for tweet_id in df["cascade_id"].unique():
-        # Filter the DataFrame for the current cascade_id
-        cascade_df = df[df["cascade_id"] == tweet_id]
-
-        # Extract the root and retweeters user_ids
-        is_root = cascade_df["is_root"]
-        root = cascade_df.loc[is_root, "user_id"].values[0]
-        retweeters = cascade_df.loc[~is_root, "user_id"].values
-
-        # Use broadcasting to create pairs
-        new_edges = np.column_stack((np.full(retweeters.shape, root), retweeters))
-
-        # Flatten the array of arrays into a list of tuples and extend the edges list
-        all_edges.extend(map(tuple, new_edges))
-
-    # Create the global network and add the vertices and edges
+    # Map user IDs to vertex indices so edges can be handled as integers
+    all_vertices = list(set(df["user_id"]))
+    vertex_index = pd.Index(all_vertices)
+
+    # The (first) root user of each cascade, looked up for every retweet at once
+    # rather than filtering the dataframe once per cascade
+    is_root = df["is_root"]
+    cascade_roots = (
+        df.loc[is_root].drop_duplicates("cascade_id").set_index("cascade_id")["user_id"]
+    )
+    retweets = df.loc[~is_root]
+
+    # (root, retweeter) pairs
+    all_edges = np.column_stack(
+        (
+            vertex_index.get_indexer(retweets["cascade_id"].map(cascade_roots)),
+            vertex_index.get_indexer(retweets["user_id"]),
+        )
+    )
+
+    # Unique edges and their weights (number of occurrences) in one pass
+    unique_edges, weights = np.unique(all_edges, axis=0, return_counts=True)
+
+    # Create the global network and add the vertices and weighted edges
     global_net = Graph(directed=True)
-    global_net.add_vertices(list(all_vertices))
-    global_net.add_edges(list(set(all_edges)))
-
-    # Determine edge weights
-    edge_weight_counter = Counter()
-    for edge in all_edges:
-        edge_weight_counter[edge] += 1
-
-    # Update weights
-    global_net.es["weight"] = [
-        edge_weight_counter[
-            (global_net.vs[edge.source]["name"], global_net.vs[edge.target]["name"])
-        ]
-        for edge in global_net.es
-    ]
+    global_net.add_vertices(all_vertices)
+    global_net.add_edges(unique_edges.tolist())
+    global_net.es["weight"] = weights.tolist()
 
     return global_net
 